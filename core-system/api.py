@@ -4,19 +4,84 @@ api.py
 FastAPI backend for CloudRAG system.
 """
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import threading
+import time
+import orjson
+from contextlib import asynccontextmanager
+from uuid import uuid4
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Iterator, Optional, List, Dict, Tuple
 from rag_pipeline_v3 import CloudRAGSystem
 from database import TranscriptDatabase
 from investor_scraper import TranscriptScraper
+from semantic_cache import SemanticCache
 import uvicorn
 
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson (much faster on large payloads)."""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+class StreamSafeGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves /query alone: its Server-Sent Events would be
+    buffered by the compressor on Starlette releases that don't skip
+    text/event-stream. (Its JSON answers are small, so little is lost.)
+    """
+    
+    def __init__(self, app, streaming_paths: Tuple[str, ...] = ("/query",), **kwargs):
+        super().__init__(app, **kwargs)
+        self.streaming_paths = streaming_paths
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.streaming_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Created per worker process in lifespan(), not at import, so each uvicorn
+# worker builds its own state instead of inheriting it across fork
+rag_system: Optional[CloudRAGSystem] = None
+db: Optional[TranscriptDatabase] = None
+query_cache = SemanticCache()
+# Serializes replacing rag_system within this worker
+_rag_system_lock = threading.Lock()
+
+# /cost is polled by dashboards; reuse the summary for a few seconds
+COST_CACHE_TTL = 10.0
+_cost_cache: Optional[Tuple[float, Dict]] = None
+
+# Metadata key naming the /update job in progress (one at a time, across workers)
+ACTIVE_UPDATE_JOB_KEY = "update_job:active"
+# Seconds after which an active-job claim is presumed left by a worker that died
+UPDATE_JOB_TIMEOUT = 3600.0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the RAG system and database pool on worker startup."""
+    global rag_system, db
+    # FAISS index is memory-mapped so workers share its pages. Workers load
+    # one at a time (index lock): the first embeds any new transcripts, the
+    # rest just load what it saved.
+    rag_system = await asyncio.to_thread(CloudRAGSystem, mmap_index=True)
+    db = TranscriptDatabase()
+    yield
+    db.close()
+    rag_system.db.close()
+
 app = FastAPI(
     title="CloudRAG API",
     description="Intelligent Earnings Call Analysis System",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS for frontend
@@ -28,15 +93,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize system
-rag_system = CloudRAGSystem()
-db = TranscriptDatabase()
+# Compress larger JSON bodies (/stats, /transcripts/...) for clients that accept gzip.
+# Server-Sent Events are left uncompressed so tokens aren't buffered.
+app.add_middleware(StreamSafeGZipMiddleware, minimum_size=1024)
 
 # Request/Response models
 class QueryRequest(BaseModel):
     question: str
     company_filter: Optional[str] = None
     top_k: int = 6
+    ef_search: Optional[int] = Field(default=None, ge=1)  # HNSW recall/latency knob
+    stream: bool = False  # Stream the answer as Server-Sent Events
 
 class QueryResponse(BaseModel):
     answer: str
@@ -47,6 +114,67 @@ class QueryResponse(BaseModel):
 class UpdateRequest(BaseModel):
     force_update: bool = False
 
+def _refresh_rag_system(load_only: bool):
+    """
+    Load the saved index into a new CloudRAGSystem and swap it in. It is
+    built on the side, so in-flight queries finish on the old object, whose
+    state never changes under them. load_only=False embeds new transcripts first.
+    The new system shares the old one's database pool, so swaps open no
+    connections (and leave none behind with the old object).
+    """
+    global rag_system
+    with _rag_system_lock:
+        if load_only and not rag_system.index_changed_on_disk():
+            return  # another request already reloaded it
+        new_system = CloudRAGSystem(mmap_index=True, load_only=load_only, db=rag_system.db)
+        new_system.total_cost = rag_system.total_cost  # this worker's query spend so far
+        rag_system = new_system
+        # Cached answers were retrieved from the old index
+        query_cache.clear()
+
+async def _reload_if_index_changed():
+    """Pick up an index saved by another worker (e.g. by its /update job)."""
+    if rag_system.index_changed_on_disk():
+        await asyncio.to_thread(_refresh_rag_system, True)
+
+def _cached_response(result: Dict, cache_layer: str, cost: float) -> Dict:
+    """Copy of a cached query result, reporting only what this request cost."""
+    return {
+        **result,
+        "cost": cost,
+        "metadata": {**result["metadata"], "cache": cache_layer}
+    }
+
+def _sse_event(payload: Dict) -> bytes:
+    """Format one Server-Sent Event."""
+    return b"data: " + orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
+
+def _sse_response(events: Iterator[bytes]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream")
+
+def _stream_query(request: QueryRequest, q_embedding, embedding_cost: float) -> Iterator[bytes]:
+    """
+    SSE body for a streamed /query: token events, then a "done" event with
+    sources and cost. Sync generator, so Starlette runs it in the threadpool.
+    """
+    try:
+        for event in rag_system.query_stream(
+            question=request.question,
+            company_filter=request.company_filter,
+            top_k=request.top_k,
+            q_embedding=q_embedding,
+            ef_search=request.ef_search
+        ):
+            if event["type"] == "done":
+                event["cost"] += embedding_cost
+                result = {k: v for k, v in event.items() if k != "type"}
+                query_cache.put(request.question, request.company_filter, request.top_k,
+                                q_embedding, result, ef_search=request.ef_search)
+            yield _sse_event(event)
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        yield _sse_event({"type": "error", "detail": str(e)})
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -58,40 +186,77 @@ async def root():
     }
 
 @app.get("/companies")
-async def get_companies():
+def get_companies():
     """Get list of available companies."""
-    companies = db.get_all_companies()
+    summaries = db.get_company_summaries()
     
-    # Get transcript count for each
-    company_info = []
-    for company in companies:
-        transcripts = db.get_transcripts_by_company(company)
-        company_info.append({
-            "name": company,
-            "transcript_count": len(transcripts),
-            "quarters": [f"{t['quarter']} {t['fiscal_year']}" for t in transcripts]
-        })
+    company_info = [
+        {
+            "name": s['company'],
+            "transcript_count": s['transcript_count'],
+            "quarters": s['quarters']
+        }
+        for s in summaries
+    ]
     
     return {
         "companies": company_info,
-        "total": len(companies)
+        "total": len(company_info)
     }
 
 @app.post("/query", response_model=QueryResponse)
 async def query(request: QueryRequest):
-    """Query the RAG system."""
+    """
+    Query the RAG system.
+    With stream=true the answer is sent as Server-Sent Events (text/event-stream).
+    """
     try:
-        result = rag_system.query(
+        await _reload_if_index_changed()
+        
+        # Exact repeat: no OpenAI calls at all
+        cached = query_cache.get(request.question, request.company_filter, request.top_k,
+                                 ef_search=request.ef_search)
+        if cached is not None:
+            result = _cached_response(cached, "exact", 0.0)
+            if request.stream:
+                return _sse_response(iter([_sse_event({"type": "done", **result})]))
+            return result
+        
+        # Blocking OpenAI/FAISS work runs off the event loop
+        q_embedding, embedding_cost = await asyncio.to_thread(
+            rag_system.embed_question, request.question
+        )
+        
+        # Near-duplicate question: skip retrieval and generation
+        cached = query_cache.get_similar(q_embedding, request.company_filter, request.top_k,
+                                         ef_search=request.ef_search)
+        if cached is not None:
+            result = _cached_response(cached, "semantic", embedding_cost)
+            if request.stream:
+                return _sse_response(iter([_sse_event({"type": "done", **result})]))
+            return result
+        
+        if request.stream:
+            return _sse_response(_stream_query(request, q_embedding, embedding_cost))
+        
+        result = await asyncio.to_thread(
+            rag_system.query,
             question=request.question,
             company_filter=request.company_filter,
-            top_k=request.top_k
+            top_k=request.top_k,
+            q_embedding=q_embedding,
+            ef_search=request.ef_search
         )
+        result["cost"] += embedding_cost
+        
+        query_cache.put(request.question, request.company_filter, request.top_k,
+                        q_embedding, result, ef_search=request.ef_search)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/stats")
-async def get_stats():
+def get_stats():
     """Get system statistics."""
     try:
         stats = rag_system.get_system_stats()
@@ -99,41 +264,95 @@ async def get_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/update")
-async def update_transcripts(request: UpdateRequest):
+def _update_job_key(job_id: str) -> str:
+    return f"update_job:{job_id}"
+
+def _claim_update_job(claim: Dict) -> Optional[str]:
     """
-    Trigger scraper to update transcripts.
-    This is a long-running operation - in production, use background tasks.
+    Record claim as the active /update job. Returns None if it was recorded,
+    else the job_id of the job already running.
+    """
+    while not db.add_metadata(ACTIVE_UPDATE_JOB_KEY, claim):
+        active = db.get_metadata(ACTIVE_UPDATE_JOB_KEY)
+        if active is None:
+            continue  # finished in between; claim again
+        if time.time() - active["started_at"] < UPDATE_JOB_TIMEOUT:
+            return active["job_id"]
+        # Stale claim: drop it (unless another request just replaced it) and retry
+        db.delete_metadata(ACTIVE_UPDATE_JOB_KEY, active)
+    return None
+
+def _run_update(job_id: str, force_update: bool, claim: Dict):
+    """
+    Scrape + re-embed for /update. Runs after the response is sent; status is
+    kept in the metadata table so any worker can answer /update/status.
     """
     try:
-        scraper = TranscriptScraper()
-        results = scraper.scrape_all_companies(force_update=request.force_update)
+        with TranscriptScraper() as scraper:
+            results = scraper.scrape_all_companies(force_update=force_update)
         
-        # Re-create embeddings if new transcripts added
+        # Re-create embeddings if new transcripts added. They go into a new
+        # CloudRAGSystem that is swapped in when ready, so queries never
+        # search an index while vectors are being added to it.
         successful_scrapes = sum(1 for r in results.values() if r['success'])
         if successful_scrapes > 0:
-            rag_system._create_embeddings()
+            _refresh_rag_system(load_only=False)
         
-        return {
+        db.set_metadata(_update_job_key(job_id), {
             "status": "success",
             "results": results,
             "message": f"Updated {successful_scrapes} companies"
-        }
+        })
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        db.set_metadata(_update_job_key(job_id), {"status": "failed", "detail": str(e)})
+    finally:
+        db.delete_metadata(ACTIVE_UPDATE_JOB_KEY, claim)
+
+@app.post("/update", status_code=202)
+def update_transcripts(request: UpdateRequest, background_tasks: BackgroundTasks):
+    """
+    Trigger scraper to update transcripts.
+    Returns immediately; poll /update/status/{job_id} for the result.
+    While a job is running (in any worker) its job_id is returned instead
+    of starting another.
+    """
+    job_id = uuid4().hex
+    claim = {"job_id": job_id, "started_at": time.time()}
+    running_job_id = _claim_update_job(claim)
+    if running_job_id is not None:
+        return {"job_id": running_job_id, "status": "running"}
+    
+    db.set_metadata(_update_job_key(job_id), {"status": "running"})
+    background_tasks.add_task(_run_update, job_id, request.force_update, claim)
+    
+    return {"job_id": job_id, "status": "accepted"}
+
+@app.get("/update/status/{job_id}")
+def update_status(job_id: str):
+    """Get the status of an /update job."""
+    status = db.get_metadata(_update_job_key(job_id))
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown update job {job_id}")
+    return {"job_id": job_id, **status}
 
 @app.get("/transcripts/{company}")
-async def get_company_transcripts(company: str):
+def get_company_transcripts(company: str):
     """Get all transcripts for a specific company."""
+    # Unknown names (e.g. bots probing) are rejected without touching SQLite;
+    # known ones are looked up under their stored spelling (the match is case-sensitive)
+    company_name = db.get_company_name(company)
+    if company_name is None:
+        raise HTTPException(status_code=404, detail=f"No transcripts found for {company}")
+    
     try:
-        transcripts = db.get_transcripts_by_company(company)
+        transcripts = db.get_transcripts_by_company(company_name)
         
         if not transcripts:
             raise HTTPException(status_code=404, detail=f"No transcripts found for {company}")
         
         # Return without full text (too large)
         return {
-            "company": company,
+            "company": company_name,
             "transcripts": [
                 {
                     "id": t['id'],
@@ -147,14 +366,35 @@ async def get_company_transcripts(company: str):
                 for t in transcripts
             ]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/pool-health")
+def pool_health():
+    """Get SQLite connection pool metrics."""
+    return {
+        "api": db.get_pool_stats(),
+        "rag": rag_system.db.get_pool_stats()
+    }
+
+@app.get("/cache-stats")
+def cache_stats():
+    """Get query cache hit/miss counters."""
+    return query_cache.get_stats()
+
 @app.get("/cost")
-async def get_cost_summary():
-    """Get cost tracking summary."""
+def get_cost_summary():
+    """Get cost tracking summary (cached for COST_CACHE_TTL seconds)."""
+    global _cost_cache
     try:
-        return rag_system.get_cost_summary()
+        if _cost_cache is not None and _cost_cache[0] > time.monotonic():
+            return _cost_cache[1]
+        
+        summary = rag_system.get_cost_summary()
+        _cost_cache = (time.monotonic() + COST_CACHE_TTL, summary)
+        return summary
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -162,4 +402,10 @@ async def get_cost_summary():
 if __name__ == "__main__":
     print(" Starting CloudRAG API server...")
     print(" API docs available at: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Import string (not the app object) is required for multiple workers
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4"))
+    )
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+chunk_store.py
+--------------
+On-disk storage for chunk texts: one UTF-8 blob plus an int64 offsets array
+(chunk i is blob[offsets[i]:offsets[i+1]]), both memory-mapped, so loading is
+instant and only the chunks a query reads are paged in.
+Per-chunk metadata is kept as parallel columns (ChunkMetadata), saved as an
+uncompressed .npz of plain arrays: loading is a few bulk reads, no parsing.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+
+class ChunkStore:
+    """Read-mostly, append-friendly list of chunk texts backed by two files."""
+    
+    def __init__(self, blob_path: str, offsets_path: str):
+        self.blob_path = blob_path
+        self.offsets_path = offsets_path
+        self._load()
+    
+    def _load(self):
+        if Path(self.offsets_path).exists():
+            self._offsets = np.load(self.offsets_path, mmap_mode='r')
+        else:
+            self._offsets = np.zeros(1, dtype=np.int64)
+        
+        # Map only the bytes the offsets cover (np.memmap rejects empty files)
+        size = int(self._offsets[-1])
+        if size > 0:
+            self._blob = np.memmap(self.blob_path, dtype=np.uint8, mode='r', shape=(size,))
+        else:
+            self._blob = np.empty(0, dtype=np.uint8)
+    
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+    
+    def __getitem__(self, idx: int) -> str:
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return bytes(self._blob[start:end]).decode('utf-8')
+    
+    @staticmethod
+    def _encode(chunks: List[str]):
+        encoded = [chunk.encode('utf-8') for chunk in chunks]
+        lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+        return b"".join(encoded), lengths
+    
+    def _save_offsets(self, offsets: np.ndarray):
+        # Temp file + rename: readers see either the old or the new offsets
+        tmp_path = f"{self.offsets_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, offsets)
+        os.replace(tmp_path, self.offsets_path)
+    
+    def replace(self, chunks: List[str]):
+        """Replace all stored chunks."""
+        blob, lengths = self._encode(chunks)
+        
+        # New file instead of truncating: other processes may have the old one mapped
+        tmp_path = f"{self.blob_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, self.blob_path)
+        
+        self._save_offsets(np.concatenate(([0], np.cumsum(lengths))).astype(np.int64))
+        self._load()
+    
+    def append(self, chunks: List[str]):
+        """Append chunks after the existing ones."""
+        blob, lengths = self._encode(chunks)
+        end = int(self._offsets[-1])
+        
+        # Bytes past the last offset (an interrupted append) are overwritten;
+        # bytes before it are never touched, so mapped readers stay valid
+        with open(self.blob_path, "r+b" if Path(self.blob_path).exists() else "wb") as f:
+            f.seek(end)
+            f.write(blob)
+            f.truncate()
+        
+        self._save_offsets(np.concatenate((self._offsets, end + np.cumsum(lengths))).astype(np.int64))
+        self._load()
+    
+    def truncate(self, count: int):
+        """Keep only the first count chunks (the bytes after them are reused by the next append)."""
+        self._save_offsets(np.array(self._offsets[:count + 1], dtype=np.int64))
+        self._load()
+
+
+class ChunkMetadata:
+    """
+    Metadata for every chunk as parallel arrays (row i describes chunk i,
+    i.e. FAISS position i) instead of one dict per chunk.
+    """
+    
+    def __init__(self, transcript_ids=(), companies=(), quarters=(), fiscal_years=()):
+        self.transcript_ids = np.asarray(transcript_ids, dtype=np.int64)
+        self.companies = np.asarray(companies, dtype=object)
+        self.quarters = np.asarray(quarters, dtype=object)
+        self.fiscal_years = np.asarray(fiscal_years, dtype=object)
+        # Lowercased company names, for building company filters
+        self.company_lower = np.array([company.lower() for company in self.companies], dtype=str)
+    
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> "ChunkMetadata":
+        """Build from per-chunk dicts (-1 / None where older records lack a field)."""
+        return cls(
+            [record.get('transcript_id', -1) for record in records],
+            [record['company'] for record in records],
+            [record.get('quarter') for record in records],
+            [record.get('fiscal_year') for record in records]
+        )
+    
+    def save(self, path: str):
+        """Write the columns to an .npz file (atomically)."""
+        # Fixed-width string arrays need no pickling; None is stored as ''
+        def text_column(values):
+            return np.array(['' if value is None else value for value in values], dtype=str)
+        
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            transcript_ids=self.transcript_ids,
+            companies=text_column(self.companies),
+            quarters=text_column(self.quarters),
+            fiscal_years=text_column(self.fiscal_years)
+        )
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> "ChunkMetadata":
+        with np.load(path) as columns:
+            def text_column(name):
+                values = columns[name].astype(object)
+                values[values == ''] = None
+                return values
+            
+            return cls(
+                columns['transcript_ids'],
+                text_column('companies'),
+                text_column('quarters'),
+                text_column('fiscal_years')
+            )
+    
+    def extend(self, other: "ChunkMetadata"):
+        """Append another set of rows after these."""
+        self.transcript_ids = np.concatenate((self.transcript_ids, other.transcript_ids))
+        self.companies = np.concatenate((self.companies, other.companies))
+        self.quarters = np.concatenate((self.quarters, other.quarters))
+        self.fiscal_years = np.concatenate((self.fiscal_years, other.fiscal_years))
+        self.company_lower = np.concatenate((self.company_lower, other.company_lower))
+    
+    def __len__(self) -> int:
+        return len(self.transcript_ids)
@@ -5,48 +5,208 @@ SQLite database schema and operations for storing transcripts and embeddings.
 Easily upgradeable to PostgreSQL for production.
 """
 
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 import json
 import numpy as np
+import zstandard
+
+# Connections kept open per TranscriptDatabase (override with CLOUDRAG_DB_POOL_SIZE)
+DEFAULT_POOL_SIZE = int(os.getenv("CLOUDRAG_DB_POOL_SIZE", "8"))
+
+# zstd level for stored transcript text (good ratio, still fast to write)
+ZSTD_LEVEL = 7
+
+def compress_text(text: str) -> bytes:
+    """Compress transcript text for storage."""
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(text.encode('utf-8'))
+
+def decompress_text(blob: bytes) -> str:
+    """Inverse of compress_text(); also registered as SQL zstd_decompress()."""
+    return zstandard.ZstdDecompressor().decompress(blob).decode('utf-8')
+
+def count_words(text: str) -> int:
+    """Whitespace-separated word count (str.split runs in C; faster than a regex scan)."""
+    return len(text.split())
+
+# How long (ms) a process waits for another one to finish creating/migrating the schema
+SCHEMA_LOCK_TIMEOUT_MS = 600000
+
+# Transcripts table; {table} lets _compress_raw_text rebuild it under a temporary name
+TRANSCRIPTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company TEXT NOT NULL,
+        quarter TEXT NOT NULL,
+        fiscal_year TEXT NOT NULL,
+        transcript_date DATE,
+        source_url TEXT,
+        raw_text_zstd BLOB NOT NULL,
+        word_count INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(company, quarter, fiscal_year)
+    )
+"""
+
+# Seconds get_stats() results are reused between writes (dashboards poll it)
+STATS_CACHE_TTL = 10.0
+# Seconds the known-company list is reused (validates /transcripts/{company})
+COMPANIES_CACHE_TTL = 10.0
 
 class TranscriptDatabase:
     """Manages transcript storage and retrieval."""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, pool_size: Optional[int] = None):
         # Default to data folder if no path provided
         if db_path is None:
             project_root = Path(__file__).parent.parent
             db_path = str(project_root / "data" / "transcripts.db")
         self.db_path = db_path
-        self.conn = None
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self._pool = None
+        
+        # Pool metrics
+        self._metrics_lock = threading.Lock()
+        self._checkouts = 0
+        self._total_wait = 0.0
+        
+        # (expires_at, stats) from the last get_stats() call
+        self._stats_cache: Optional[Tuple[float, Dict]] = None
+        # (expires_at, names, lowercased names, lowercased -> stored name)
+        # from the last company lookup
+        self._companies_cache: Optional[Tuple[float, List[str], frozenset, Dict[str, str]]] = None
+        
         self.init_database()
     
     def init_database(self):
-        """Initialize database schema."""
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        """Initialize connection pool and database schema."""
+        self._pool = queue.Queue(maxsize=self.pool_size)
+        for _ in range(self.pool_size):
+            self._pool.put(self._new_connection())
+        
+        with self._conn() as conn:
+            self._create_schema(conn)
+        print(" Database initialized")
+    
+    def _new_connection(self) -> sqlite3.Connection:
+        """Open a connection that can be lent to any worker thread."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        # Used by the FTS triggers to index the compressed transcript text
+        conn.create_function("zstd_decompress", 1, decompress_text, deterministic=True)
+        self._configure_connection(conn)
+        return conn
+    
+    @contextmanager
+    def _conn(self):
+        """Borrow a pooled connection for the duration of a with-block."""
+        start = time.perf_counter()
+        conn = self._pool.get()
+        waited = time.perf_counter() - start
         
-        cursor = self.conn.cursor()
+        with self._metrics_lock:
+            self._checkouts += 1
+            self._total_wait += waited
+        
+        try:
+            yield conn
+        finally:
+            # Don't hand a half-finished transaction (and its write lock) to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+    
+    def get_pool_stats(self) -> Dict:
+        """Get connection pool metrics."""
+        available = self._pool.qsize()
+        with self._metrics_lock:
+            checkouts = self._checkouts
+            total_wait = self._total_wait
+        
+        return {
+            "pool_size": self.pool_size,
+            "available": available,
+            "in_use": self.pool_size - available,
+            "total_checkouts": checkouts,
+            "avg_wait_ms": (total_wait / checkouts * 1000) if checkouts else 0.0
+        }
+    
+    def _create_schema(self, conn: sqlite3.Connection):
+        """
+        Create tables and indexes if they don't exist, migrating older layouts.
+        Runs as one write transaction: every API worker opens the database at
+        startup, and the others wait here instead of racing the same migration.
+        """
+        cursor = conn.cursor()
+        
+        conn.execute(f"PRAGMA busy_timeout={SCHEMA_LOCK_TIMEOUT_MS}")
+        try:
+            # Take the write lock before looking at the schema, so what is
+            # checked below can't change until commit
+            conn.execute("BEGIN IMMEDIATE")
+        finally:
+            conn.execute("PRAGMA busy_timeout=5000")
         
         # Transcripts table
+        cursor.execute(TRANSCRIPTS_TABLE_SQL.format(table="transcripts"))
+        
+        # Older databases stored raw_text as plain TEXT
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(transcripts)")}
+        compress_existing = 'raw_text' in columns
+        if compress_existing:
+            self._compress_raw_text(conn, add_column='raw_text_zstd' not in columns)
+        
+        # Full-text index over transcript text. Contentless (the text only lives
+        # compressed in transcripts), so the triggers hand it the decompressed text.
+        fts_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcripts_fts'"
+        ).fetchone()
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcripts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                company TEXT NOT NULL,
-                quarter TEXT NOT NULL,
-                fiscal_year TEXT NOT NULL,
-                transcript_date DATE,
-                source_url TEXT,
-                raw_text TEXT NOT NULL,
-                word_count INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(company, quarter, fiscal_year)
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+                company UNINDEXED,
+                quarter UNINDEXED,
+                fiscal_year UNINDEXED,
+                raw_text,
+                content=''
             )
         """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS transcripts_fts_insert AFTER INSERT ON transcripts BEGIN
+                INSERT INTO transcripts_fts(rowid, company, quarter, fiscal_year, raw_text)
+                VALUES (new.id, new.company, new.quarter, new.fiscal_year, zstd_decompress(new.raw_text_zstd));
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS transcripts_fts_delete AFTER DELETE ON transcripts BEGIN
+                INSERT INTO transcripts_fts(transcripts_fts, rowid, company, quarter, fiscal_year, raw_text)
+                VALUES ('delete', old.id, old.company, old.quarter, old.fiscal_year, zstd_decompress(old.raw_text_zstd));
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS transcripts_fts_update AFTER UPDATE ON transcripts BEGIN
+                INSERT INTO transcripts_fts(transcripts_fts, rowid, company, quarter, fiscal_year, raw_text)
+                VALUES ('delete', old.id, old.company, old.quarter, old.fiscal_year, zstd_decompress(old.raw_text_zstd));
+                INSERT INTO transcripts_fts(rowid, company, quarter, fiscal_year, raw_text)
+                VALUES (new.id, new.company, new.quarter, new.fiscal_year, zstd_decompress(new.raw_text_zstd));
+            END
+        """)
+        if not fts_exists:
+            # Index transcripts that were stored before the FTS table existed
+            cursor.execute("""
+                INSERT INTO transcripts_fts(rowid, company, quarter, fiscal_year, raw_text)
+                SELECT id, company, quarter, fiscal_year, zstd_decompress(raw_text_zstd)
+                FROM transcripts
+            """)
         
         # Embedding chunks table
         cursor.execute("""
@@ -75,195 +235,443 @@ class TranscriptDatabase:
         # Indexes for faster queries
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_company ON transcripts(company)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_quarter ON transcripts(quarter)")
+        # Matches get_transcripts_by_company's WHERE + ORDER BY, so no sort step
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_company_fy_q ON transcripts(company, fiscal_year DESC, quarter DESC)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcript_id ON embedding_chunks(transcript_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_faiss_position ON embedding_chunks(faiss_index_position)")
         
-        self.conn.commit()
-        print(" Database initialized")
+        conn.commit()
+        
+        if compress_existing:
+            # Outside the transaction (VACUUM can't run in one). Give the pages freed by the plain-text column back to the filesystem
+            conn.execute("VACUUM")
+    
+    def _compress_raw_text(self, conn: sqlite3.Connection, add_column: bool = True):
+        """
+        One-time migration: raw_text TEXT -> zstd-compressed raw_text_zstd BLOB.
+        Runs inside _create_schema's transaction, so it applies fully or not at all.
+        """
+        print(" Compressing stored transcript text...")
+        # The old FTS index and triggers read raw_text; they are recreated afterwards
+        for trigger in ("transcripts_fts_insert", "transcripts_fts_delete", "transcripts_fts_update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS transcripts_fts")
+        
+        if add_column:
+            conn.execute("ALTER TABLE transcripts ADD COLUMN raw_text_zstd BLOB")
+        rows = conn.execute("SELECT id, raw_text FROM transcripts").fetchall()
+        conn.executemany(
+            "UPDATE transcripts SET raw_text_zstd = ? WHERE id = ?",
+            [(compress_text(row['raw_text']), row['id']) for row in rows]
+        )
+        
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            conn.execute("ALTER TABLE transcripts DROP COLUMN raw_text")
+        else:
+            # No DROP COLUMN before SQLite 3.35: copy into a table without it
+            # (indexes are recreated by _create_schema)
+            conn.execute("DROP TABLE IF EXISTS transcripts_migrated")
+            conn.execute(TRANSCRIPTS_TABLE_SQL.format(table="transcripts_migrated"))
+            conn.execute("""
+                INSERT INTO transcripts_migrated
+                (id, company, quarter, fiscal_year, transcript_date, source_url,
+                 raw_text_zstd, word_count, created_at, updated_at)
+                SELECT id, company, quarter, fiscal_year, transcript_date, source_url,
+                       raw_text_zstd, word_count, created_at, updated_at
+                FROM transcripts
+            """)
+            conn.execute("DROP TABLE transcripts")
+            conn.execute("ALTER TABLE transcripts_migrated RENAME TO transcripts")
+    
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """
+        Apply performance PRAGMAs to a connection.
+        WAL lets readers proceed while a write is in progress, and NORMAL sync
+        skips the extra fsync per commit. WAL keeps transcripts.db-wal and
+        transcripts.db-shm sidecar files next to the database.
+        """
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # ~64MB page cache
+        conn.execute("PRAGMA mmap_size=268435456")  # 256MB memory-mapped I/O
+        conn.execute("PRAGMA busy_timeout=5000")  # ms to wait on a locked db
+        # INSERT OR REPLACE only fires DELETE triggers (used by the FTS index) with this on
+        conn.execute("PRAGMA recursive_triggers=ON")
     
     def insert_transcript(self, company: str, quarter: str, fiscal_year: str, 
                          raw_text: str, source_url: Optional[str] = None,
                          transcript_date: Optional[str] = None) -> int:
         """Insert a new transcript. Returns transcript_id."""
-        cursor = self.conn.cursor()
-        
-        word_count = len(raw_text.split())
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            
+            word_count = count_words(raw_text)
+            
+            cursor.execute("""
+                INSERT OR REPLACE INTO transcripts 
+                (company, quarter, fiscal_year, transcript_date, source_url, raw_text_zstd, word_count, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (company, quarter, fiscal_year, transcript_date, source_url,
+                  compress_text(raw_text), word_count))
+            
+            conn.commit()
+            self._invalidate_caches()
+            return cursor.lastrowid
+    
+    def insert_transcripts(self, records: List[Dict]) -> int:
+        """
+        Bulk insert transcripts in a single transaction (one commit).
+        Each record has the insert_transcript() keyword arguments.
+        Returns the number of rows written.
+        """
+        rows = [
+            (r['company'], r['quarter'], r['fiscal_year'], r.get('transcript_date'),
+             r.get('source_url'), compress_text(r['raw_text']), count_words(r['raw_text']))
+            for r in records
+        ]
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO transcripts 
-            (company, quarter, fiscal_year, transcript_date, source_url, raw_text, word_count, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """, (company, quarter, fiscal_year, transcript_date, source_url, raw_text, word_count))
+        with self._conn() as conn:
+            with conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO transcripts 
+                    (company, quarter, fiscal_year, transcript_date, source_url, raw_text_zstd, word_count, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, rows)
         
-        self.conn.commit()
-        return cursor.lastrowid
+        self._invalidate_caches()
+        return len(rows)
     
     def insert_embedding_chunks(self, transcript_id: int, chunks: List[str], 
                                faiss_positions: List[int]):
         """Insert embedding chunks for a transcript."""
-        cursor = self.conn.cursor()
-        
-        # Delete existing chunks for this transcript
-        cursor.execute("DELETE FROM embedding_chunks WHERE transcript_id = ?", (transcript_id,))
+        rows = [
+            (transcript_id, chunk_index, chunk_text, faiss_pos)
+            for chunk_index, (chunk_text, faiss_pos) in enumerate(zip(chunks, faiss_positions))
+        ]
         
-        # Insert new chunks
-        for chunk_index, (chunk_text, faiss_pos) in enumerate(zip(chunks, faiss_positions)):
-            cursor.execute("""
-                INSERT INTO embedding_chunks 
-                (transcript_id, chunk_index, chunk_text, faiss_index_position)
-                VALUES (?, ?, ?, ?)
-            """, (transcript_id, chunk_index, chunk_text, faiss_pos))
+        with self._conn() as conn:
+            # Delete + insert as one transaction (commits on success, rolls back on error)
+            with conn:
+                cursor = conn.cursor()
+                
+                # Delete existing chunks for this transcript
+                cursor.execute("DELETE FROM embedding_chunks WHERE transcript_id = ?", (transcript_id,))
+                
+                # Insert new chunks in one prepared-statement batch
+                cursor.executemany("""
+                    INSERT INTO embedding_chunks 
+                    (transcript_id, chunk_index, chunk_text, faiss_index_position)
+                    VALUES (?, ?, ?, ?)
+                """, rows)
         
-        self.conn.commit()
+        self._invalidate_caches()
     
     def get_transcript_by_id(self, transcript_id: int) -> Optional[Dict]:
-        """Get a transcript by ID."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM transcripts WHERE id = ?", (transcript_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        """Get a transcript by ID (with its text decompressed into raw_text)."""
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM transcripts WHERE id = ?", (transcript_id,))
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        transcript = dict(row)
+        transcript['raw_text'] = decompress_text(transcript.pop('raw_text_zstd'))
+        return transcript
+    
+    def get_transcript_text(self, transcript_id: int) -> Optional[str]:
+        """Get only the raw text of a transcript."""
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT raw_text_zstd FROM transcripts WHERE id = ?", (transcript_id,))
+            row = cursor.fetchone()
+        
+        return decompress_text(row['raw_text_zstd']) if row else None
     
     def get_transcripts_by_company(self, company: str) -> List[Dict]:
         """Get all transcripts for a company."""
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT * FROM transcripts 
-            WHERE company = ? 
-            ORDER BY fiscal_year DESC, quarter DESC
-        """, (company,))
-        return [dict(row) for row in cursor.fetchall()]
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            # The transcript text is left out on purpose - use get_transcript_text for the full text
+            cursor.execute("""
+                SELECT id, company, quarter, fiscal_year, transcript_date,
+                       source_url, word_count, created_at, updated_at
+                FROM transcripts 
+                WHERE company = ? 
+                ORDER BY fiscal_year DESC, quarter DESC
+            """, (company,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def _companies(self) -> Tuple[float, List[str], frozenset, Dict[str, str]]:
+        cached = self._companies_cache
+        if cached is not None and cached[0] > time.monotonic():
+            return cached
+        
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT company FROM transcripts ORDER BY company")
+            names = [row['company'] for row in cursor.fetchall()]
+        
+        by_lower = {name.lower(): name for name in names}
+        cached = (time.monotonic() + COMPANIES_CACHE_TTL, names,
+                  frozenset(by_lower), by_lower)
+        self._companies_cache = cached
+        return cached
     
     def get_all_companies(self) -> List[str]:
         """Get list of all companies in database."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT DISTINCT company FROM transcripts ORDER BY company")
-        return [row['company'] for row in cursor.fetchall()]
+        return list(self._companies()[1])
+    
+    def get_max_transcript_id(self) -> int:
+        """Highest transcript id (0 if empty); ids only grow, so it signals new rows."""
+        with self._conn() as conn:
+            row = conn.execute("SELECT MAX(id) AS max_id FROM transcripts").fetchone()
+        return row['max_id'] or 0
+    
+    def get_all_companies_set(self) -> frozenset:
+        """Lowercased company names, for cheap membership checks."""
+        return self._companies()[2]
+    
+    def get_company_name(self, company: str) -> Optional[str]:
+        """Company name as stored, matched case-insensitively (None if unknown)."""
+        return self._companies()[3].get(company.lower())
+    
+    def get_company_summaries(self) -> List[Dict]:
+        """Get transcript count and quarter list for every company in one query."""
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            # Group in Python: GROUP_CONCAT order isn't guaranteed by SQLite
+            cursor.execute("""
+                SELECT company, quarter, fiscal_year FROM transcripts
+                ORDER BY company, fiscal_year DESC, quarter DESC
+            """)
+            summaries: Dict[str, Dict] = {}
+            for row in cursor.fetchall():
+                summary = summaries.setdefault(
+                    row['company'],
+                    {"company": row['company'], "transcript_count": 0, "quarters": []}
+                )
+                summary["transcript_count"] += 1
+                summary["quarters"].append(f"{row['quarter']} {row['fiscal_year']}")
+            return list(summaries.values())
+    
+    def keyword_search(self, query: str, limit: int = 20) -> List[int]:
+        """
+        Full-text search over transcripts.
+        Returns transcript IDs matching any query term, best BM25 score first.
+        """
+        # Quote each term so punctuation in questions can't break FTS5 syntax
+        terms = [t for t in re.findall(r'\w+', query.lower()) if len(t) > 1]
+        if not terms:
+            return []
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT rowid FROM transcripts_fts
+                WHERE transcripts_fts MATCH ?
+                ORDER BY bm25(transcripts_fts)
+                LIMIT ?
+            """, (match, limit))
+            return [row['rowid'] for row in cursor.fetchall()]
     
     def get_chunk_by_faiss_position(self, faiss_position: int) -> Optional[Dict]:
         """Get chunk and associated transcript info by FAISS index position."""
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT 
-                ec.chunk_text,
-                ec.chunk_index,
-                t.company,
-                t.quarter,
-                t.fiscal_year,
-                t.transcript_date
-            FROM embedding_chunks ec
-            JOIN transcripts t ON ec.transcript_id = t.id
-            WHERE ec.faiss_index_position = ?
-        """, (faiss_position,))
-        
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return self.get_chunks_by_faiss_positions([faiss_position]).get(faiss_position)
+    
+    def get_chunks_by_faiss_positions(self, positions: List[int]) -> Dict[int, Dict]:
+        """
+        Batched get_chunk_by_faiss_position: one query for all positions.
+        Returns {faiss_position: chunk info}; unknown positions are left out.
+        """
+        positions = [int(p) for p in dict.fromkeys(positions)]
+        if not positions:
+            return {}
+        
+        placeholders = ",".join("?" * len(positions))
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT 
+                    ec.chunk_text,
+                    ec.chunk_index,
+                    ec.faiss_index_position,
+                    t.company,
+                    t.quarter,
+                    t.fiscal_year,
+                    t.transcript_date
+                FROM embedding_chunks ec
+                JOIN transcripts t ON ec.transcript_id = t.id
+                WHERE ec.faiss_index_position IN ({placeholders})
+            """, positions)
+            
+            return {row['faiss_index_position']: dict(row) for row in cursor.fetchall()}
+    
+    def get_transcript_ids_by_faiss_position(self, count: int) -> np.ndarray:
+        """transcript_id of each FAISS position below count, from the chunk mappings (-1 if unmapped)."""
+        transcript_ids = np.full(count, -1, dtype=np.int64)
+        with self._conn() as conn:
+            rows = conn.execute("""
+                SELECT faiss_index_position, transcript_id FROM embedding_chunks
+                WHERE faiss_index_position < ?
+            """, (count,)).fetchall()
+        
+        if rows:
+            positions, ids = np.array([tuple(row) for row in rows], dtype=np.int64).T
+            transcript_ids[positions] = ids
+        return transcript_ids
     
     def get_chunks_by_transcript_id(self, transcript_id: int) -> List[Dict]:
         """Get all chunks for a transcript."""
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT * FROM embedding_chunks 
-            WHERE transcript_id = ? 
-            ORDER BY chunk_index
-        """, (transcript_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM embedding_chunks 
+                WHERE transcript_id = ? 
+                ORDER BY chunk_index
+            """, (transcript_id,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def _invalidate_caches(self):
+        """Drop cached get_stats()/company results after a write."""
+        self._stats_cache = None
+        self._companies_cache = None
     
     def get_stats(self) -> Dict:
-        """Get database statistics."""
-        cursor = self.conn.cursor()
-        
-        stats = {}
-        
-        # Total transcripts
-        cursor.execute("SELECT COUNT(*) as count FROM transcripts")
-        stats['total_transcripts'] = cursor.fetchone()['count']
+        """Get database statistics (cached for STATS_CACHE_TTL seconds)."""
+        cached = self._stats_cache
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
         
-        # Total chunks
-        cursor.execute("SELECT COUNT(*) as count FROM embedding_chunks")
-        stats['total_chunks'] = cursor.fetchone()['count']
-        
-        # Companies
-        cursor.execute("SELECT COUNT(DISTINCT company) as count FROM transcripts")
-        stats['total_companies'] = cursor.fetchone()['count']
-        
-        # Total words
-        cursor.execute("SELECT SUM(word_count) as total FROM transcripts")
-        stats['total_words'] = cursor.fetchone()['total'] or 0
-        
-        # By company
-        cursor.execute("""
-            SELECT company, COUNT(*) as transcript_count, SUM(word_count) as total_words
-            FROM transcripts
-            GROUP BY company
-            ORDER BY company
-        """)
-        stats['by_company'] = [dict(row) for row in cursor.fetchall()]
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            
+            stats = {}
+            
+            # Total transcripts
+            cursor.execute("SELECT COUNT(*) as count FROM transcripts")
+            stats['total_transcripts'] = cursor.fetchone()['count']
+            
+            # Total chunks
+            cursor.execute("SELECT COUNT(*) as count FROM embedding_chunks")
+            stats['total_chunks'] = cursor.fetchone()['count']
+            
+            # Companies
+            cursor.execute("SELECT COUNT(DISTINCT company) as count FROM transcripts")
+            stats['total_companies'] = cursor.fetchone()['count']
+            
+            # Total words
+            cursor.execute("SELECT SUM(word_count) as total FROM transcripts")
+            stats['total_words'] = cursor.fetchone()['total'] or 0
+            
+            # By company
+            cursor.execute("""
+                SELECT company, COUNT(*) as transcript_count, SUM(word_count) as total_words
+                FROM transcripts
+                GROUP BY company
+                ORDER BY company
+            """)
+            stats['by_company'] = [dict(row) for row in cursor.fetchall()]
         
+        self._stats_cache = (time.monotonic() + STATS_CACHE_TTL, stats)
         return stats
     
     def set_metadata(self, key: str, value: any):
         """Store metadata (e.g., last_scrape, embedding_cost)."""
-        cursor = self.conn.cursor()
-        
-        # Convert value to JSON string if not string
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            
+            # Convert value to JSON string if not string
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            
+            cursor.execute("""
+                INSERT OR REPLACE INTO metadata (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """, (key, value))
+            
+            conn.commit()
+    
+    def add_metadata(self, key: str, value: any) -> bool:
+        """
+        Store metadata only if the key is unset (atomic, so usable as a claim
+        across processes). Returns True if it was stored.
+        """
         if not isinstance(value, str):
             value = json.dumps(value)
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO metadata (key, value, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (key, value))
-        
-        self.conn.commit()
+        with self._conn() as conn:
+            with conn:
+                cursor = conn.execute("""
+                    INSERT OR IGNORE INTO metadata (key, value, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                """, (key, value))
+                return cursor.rowcount == 1
+    
+    def delete_metadata(self, key: str, value: any = None):
+        """Delete metadata; with value given, only if the key still holds that value."""
+        with self._conn() as conn:
+            with conn:
+                if value is None:
+                    conn.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                else:
+                    if not isinstance(value, str):
+                        value = json.dumps(value)
+                    conn.execute("DELETE FROM metadata WHERE key = ? AND value = ?", (key, value))
     
     def get_metadata(self, key: str) -> Optional[any]:
         """Get metadata value."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT value FROM metadata WHERE key = ?", (key,))
-        row = cursor.fetchone()
-        
-        if row:
-            try:
-                return json.loads(row['value'])
-            except:
-                return row['value']
-        return None
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM metadata WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            
+            if row:
+                try:
+                    return json.loads(row['value'])
+                except:
+                    return row['value']
+            return None
     
     def delete_old_quarters(self, keep_quarters: int = 4):
         """
         Delete old quarters to maintain rolling window.
         Keeps only the most recent N quarters per company.
         """
-        cursor = self.conn.cursor()
-        
-        for company in self.get_all_companies():
-            # Get transcript IDs to keep
-            cursor.execute("""
-                SELECT id FROM transcripts
-                WHERE company = ?
-                ORDER BY fiscal_year DESC, quarter DESC
-                LIMIT ?
-            """, (company, keep_quarters))
-            
-            keep_ids = [row['id'] for row in cursor.fetchall()]
+        with self._conn() as conn:
+            cursor = conn.cursor()
             
-            if not keep_ids:
-                continue
+            # Rank each company's transcripts newest first and drop everything past N
+            cursor.execute("""
+                DELETE FROM transcripts WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY company
+                            ORDER BY fiscal_year DESC, quarter DESC
+                        ) AS rn
+                        FROM transcripts
+                    )
+                    WHERE rn > ?
+                )
+            """, (keep_quarters,))
             
-            # Delete old transcripts
-            placeholders = ','.join('?' * len(keep_ids))
-            cursor.execute(f"""
-                DELETE FROM transcripts
-                WHERE company = ? AND id NOT IN ({placeholders})
-            """, (company, *keep_ids))
+            conn.commit()
+        
+        self._invalidate_caches()
         
-        self.conn.commit()
         print(f" Cleaned up old quarters, kept {keep_quarters} most recent per company")
     
     def close(self):
-        """Close database connection."""
-        if self.conn:
-            self.conn.close()
+        """Close all pooled connections."""
+        if self._pool is None:
+            return
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
     
     def __enter__(self):
         return self
@@ -296,33 +704,37 @@ def migrate_from_files(transcripts_dir: str = None, db_path: str = None):
     files = list(transcripts_path.rglob("*.txt"))
     print(f"Found {len(files)} transcript files")
     
+    records = []
+    parsed_files = []
     for file_path in files:
         # Parse filename (e.g., "salesforce_q2_fy26.txt")
         filename = file_path.stem.lower()
         parts = filename.split('_')
         
         if len(parts) >= 3:
-            company = parts[0].title()
-            quarter = parts[1].upper()
-            fiscal_year = parts[2].upper()
+            records.append({
+                'company': parts[0].title(),
+                'quarter': parts[1].upper(),
+                'fiscal_year': parts[2].upper(),
+                'source_url': None
+            })
+            parsed_files.append(file_path)
         else:
             print(f"  Skipping {filename} (can't parse)")
-            continue
-        
-        # Read transcript
-        with open(file_path, 'r', encoding='utf-8') as f:
-            raw_text = f.read()
-        
-        # Insert into database
-        transcript_id = db.insert_transcript(
-            company=company,
-            quarter=quarter,
-            fiscal_year=fiscal_year,
-            raw_text=raw_text,
-            source_url=None
-        )
-        
-        print(f" Migrated: {company} {quarter} {fiscal_year} (ID: {transcript_id})")
+    
+    # Reading is I/O-bound, so read the files concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        texts = list(executor.map(lambda p: p.read_text(encoding='utf-8'), parsed_files))
+    
+    for record, raw_text in zip(records, texts):
+        record['raw_text'] = raw_text
+    
+    # One transaction for all rows instead of a commit per file
+    migrated = db.insert_transcripts(records)
+    
+    for record in records:
+        print(f" Migrated: {record['company']} {record['quarter']} {record['fiscal_year']}")
+    print(f" Migrated {migrated} transcripts")
     
     db.close()
     print(" Migration complete!")
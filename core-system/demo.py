@@ -4,17 +4,30 @@ demo.py
 Interactive demo script for showcasing CloudRAG
 """
 
+import os
 import time
 import sys
 from typing import Optional
 from rag_pipeline_v3 import CloudRAGSystem
 
+# Set CLOUDRAG_FAST_DEMO=1 to print answers at once (scripting, benchmarks)
+FAST_DEMO = bool(os.getenv("CLOUDRAG_FAST_DEMO"))
+
+# Characters written per flush in the typewriter effect
+TYPEWRITER_BATCH = 16
+
 def typewriter_print(text: str, delay: float = 0.03):
     """Print text with typewriter effect."""
-    for char in text:
-        sys.stdout.write(char)
+    if FAST_DEMO or delay <= 0:
+        print(text)
+        return
+    
+    # Flush in small batches instead of per character; same overall pace
+    for i in range(0, len(text), TYPEWRITER_BATCH):
+        batch = text[i:i + TYPEWRITER_BATCH]
+        sys.stdout.write(batch)
         sys.stdout.flush()
-        time.sleep(delay)
+        time.sleep(delay * len(batch))
     print()
 
 def print_header(title: str):
@@ -6,11 +6,20 @@ Handles both HTML and PDF formats. Updates rolling 4-quarter window.
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+import pymupdf
 import PyPDF2
 import pdfplumber
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
+from urllib.parse import urlparse
+import json
+import os
+import threading
 import time
 import re
 import sys
@@ -28,6 +37,41 @@ class SimpleLogger:
 
 logger = SimpleLogger()
 
+# Transcripts of one company downloaded at the same time
+TRANSCRIPT_WORKERS = 4
+# Requests allowed in flight to a single host at once
+MAX_REQUESTS_PER_HOST = 2
+# Minimum seconds between request starts to a single host (2 req/sec)
+MIN_REQUEST_INTERVAL = 0.5
+
+# Keep-alive connections per host, shared by the concurrent scraping threads
+HTTP_POOL_SIZE = 20
+
+# Bytes per read when streaming PDFs to disk
+PDF_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Link discovery only needs <a href> tags, so IR pages are parsed with just
+# those (lxml is the fast C parser). Transcript pages are parsed whole: text
+# can sit in any element (table, li, pre, span...).
+_LINKS_ONLY = SoupStrainer('a', href=True)
+
+# Precompiled once instead of per link / per document.
+# Quarter patterns like "Q1 2026", "Q4 FY25", "q3 fy2025" etc.
+_QUARTER_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'Q[1-4]\s*(?:FY)?\s*20\d{2}',
+        r'Q[1-4]\s*(?:Fiscal)?\s*20\d{2}',
+        r'(First|Second|Third|Fourth)\s*Quarter\s*20\d{2}',
+        r'q[1-4]\s*fy\s*20\d{2}'
+    )
+]
+# Keywords that mark a link as a possible transcript (one scan per string)
+_LINK_RE = re.compile(r'transcript|earnings|call|quarterly|results', re.IGNORECASE)
+_FY_RE = re.compile(r'fy20(\d{2})')
+_QUARTER_FY_RE = re.compile(r'(q\d)fy20(\d{2})')
+_WS_RE = re.compile(r'\s+')
+_PAGE_RE = re.compile(r'Page \d+')
+
 class TranscriptScraper:
     """Scrapes earnings call transcripts from company investor relations pages."""
     
@@ -42,7 +86,7 @@ class TranscriptScraper:
         "workday": "https://investor.workday.com/financial-information/quarterly-results/default.aspx"
     }
     
-    def __init__(self, output_dir: str = None, pdf_dir: str = None):
+    def __init__(self, output_dir: str = None, pdf_dir: str = None, page_cache_path: str = None):
         # Default to data folder if no paths provided
         if output_dir is None:
             project_root = Path(__file__).parent.parent
@@ -50,9 +94,18 @@ class TranscriptScraper:
         if pdf_dir is None:
             project_root = Path(__file__).parent.parent
             pdf_dir = str(project_root / "data" / "raw_pdfs")
+        if page_cache_path is None:
+            project_root = Path(__file__).parent.parent
+            page_cache_path = str(project_root / "data" / "ir_page_cache.json")
             
         self.output_dir = Path(output_dir)
         self.pdf_dir = Path(pdf_dir)
+        
+        # IR page validators (ETag / Last-Modified) and the links found last time,
+        # so an unchanged page comes back as a bodiless 304
+        self.page_cache_path = Path(page_cache_path)
+        self._page_cache = self._load_page_cache()
+        self._page_cache_lock = threading.Lock()
         # Create pdf dir but not output dir (will create per-company folders)
         self.pdf_dir.mkdir(parents=True, exist_ok=True)
         
@@ -60,37 +113,140 @@ class TranscriptScraper:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
+        
+        # One session for every request: reuses TCP/TLS connections per host
+        # and retries transient failures with backoff
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Per-host request slots and start times (politeness without
+        # serializing other hosts)
+        self._host_slots: Dict[str, threading.Semaphore] = {}
+        self._next_request_at: Dict[str, float] = {}
+        self._host_slots_lock = threading.Lock()
+        # Guards the exists-check + write of transcript files
+        self._write_lock = threading.Lock()
+    
+    @contextmanager
+    def _host_slot(self, url: str):
+        """
+        Hold one of the MAX_REQUESTS_PER_HOST request slots for url's host,
+        starting no sooner than MIN_REQUEST_INTERVAL after the previous request.
+        """
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            slot = self._host_slots.setdefault(host, threading.Semaphore(MAX_REQUESTS_PER_HOST))
+        with slot:
+            self._wait_for_host(host)
+            yield
+    
+    def _wait_for_host(self, host: str):
+        # Reserve the next start time under the lock, sleep outside it
+        with self._host_slots_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request_at.get(host, now))
+            self._next_request_at[host] = start + MIN_REQUEST_INTERVAL
+        if start > now:
+            time.sleep(start - now)
+    
+    def _load_page_cache(self) -> Dict:
+        try:
+            with open(self.page_cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _update_page_cache(self, url: str, response: requests.Response, links: List[Dict]):
+        """Remember an IR page's validators and links, if the server sent any."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        
+        with self._page_cache_lock:
+            self._page_cache[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'links': links
+            }
+            self.page_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{self.page_cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._page_cache, f)
+            os.replace(tmp_path, self.page_cache_path)
+    
+    def _transcript_path(self, company: str, quarter: str) -> Path:
+        """Where a company's transcript for a quarter is saved."""
+        clean_quarter = quarter.lower().replace(' ', '_')
+        clean_quarter = _FY_RE.sub(r'fy\1', clean_quarter)
+        clean_quarter = _QUARTER_FY_RE.sub(r'\1_fy\2', clean_quarter)
+        
+        filename = f"{company.lower()}_{clean_quarter}.txt"
+        return self.output_dir / company.lower() / filename
+    
+    @staticmethod
+    def _declared_encoding(response: requests.Response) -> str:
+        """
+        Charset from the Content-Type header, else UTF-8. Handing this to
+        BeautifulSoup skips its byte-level encoding detection. A wrong guess only
+        affects non-ASCII characters, which _clean_text drops anyway.
+        """
+        if 'charset' in response.headers.get('Content-Type', '').lower():
+            return response.encoding
+        return 'utf-8'
+    
+    def close(self):
+        """Close pooled HTTP connections."""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
     
     def scrape_all_companies(self, force_update: bool = False):
-        """Scrape transcripts for all companies."""
+        """
+        Scrape transcripts for all companies.
+        Each company is on its own IR host, so companies are scraped
+        concurrently (network-bound; requests releases the GIL while waiting).
+        """
         logger.info("Starting scraper for all companies...")
         
-        results = {}
-        for company, url in self.COMPANY_URLS.items():
-            logger.info(f"\n{'='*60}")
-            logger.info(f"Scraping {company.upper()}")
-            logger.info(f"{'='*60}")
-            
-            try:
-                transcripts = self.scrape_company(company, url, force_update)
-                results[company] = {
-                    "success": True,
-                    "transcripts": len(transcripts),
-                    "files": transcripts
-                }
-                logger.info(f"SUCCESS: {company}: {len(transcripts)} transcripts scraped")
-                
-                # Be polite.
-                time.sleep(3)
-                
-            except Exception as e:
-                logger.error(f"{company}: Failed - {str(e)}")
-                results[company] = {
-                    "success": False,
-                    "error": str(e)
-                }
+        with ThreadPoolExecutor(max_workers=len(self.COMPANY_URLS)) as executor:
+            futures = {
+                company: executor.submit(self._scrape_company_result, company, url, force_update)
+                for company, url in self.COMPANY_URLS.items()
+            }
+            # Keep COMPANY_URLS order in the results
+            return {company: future.result() for company, future in futures.items()}
+    
+    def _scrape_company_result(self, company: str, url: str, force_update: bool) -> Dict:
+        """Scrape one company and summarize the outcome for scrape_all_companies."""
+        logger.info(f"Scraping {company.upper()}")
         
-        return results
+        try:
+            transcripts = self.scrape_company(company, url, force_update)
+            logger.info(f"SUCCESS: {company}: {len(transcripts)} transcripts scraped")
+            return {
+                "success": True,
+                "transcripts": len(transcripts),
+                "files": transcripts
+            }
+        except Exception as e:
+            logger.error(f"{company}: Failed - {str(e)}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
     
     def scrape_company(self, company: str, base_url: str, force_update: bool = False) -> List[str]:
         """
@@ -99,66 +255,89 @@ class TranscriptScraper:
         """
         logger.info(f"Fetching IR page: {base_url}")
         
+        # Conditional request: the server answers 304 if the page is unchanged
+        cached = None if force_update else self._page_cache.get(base_url)
+        conditional_headers = {}
+        if cached:
+            if cached.get('etag'):
+                conditional_headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                conditional_headers['If-Modified-Since'] = cached['last_modified']
+        
         try:
-            response = requests.get(base_url, headers=self.headers, timeout=30)
+            with self._host_slot(base_url):
+                response = self.session.get(base_url, headers=conditional_headers, timeout=30)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to fetch IR page: {e}")
             return []
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        if response.status_code == 304 and cached:
+            transcript_links = cached['links']
+            logger.info(f"IR page unchanged, reusing {len(transcript_links)} cached links")
+        else:
+            soup = BeautifulSoup(response.content, 'lxml', parse_only=_LINKS_ONLY,
+                                 from_encoding=self._declared_encoding(response))
+            
+            # Find all links that might be transcripts
+            transcript_links = self._find_transcript_links(soup, base_url)
+            logger.info(f"Found {len(transcript_links)} potential transcript links")
+            self._update_page_cache(base_url, response, transcript_links)
+        
+        # Get last 4 quarters, downloaded concurrently (_host_slot keeps it polite)
+        with ThreadPoolExecutor(max_workers=TRANSCRIPT_WORKERS) as executor:
+            saved_files = list(executor.map(
+                lambda link_info: self._scrape_transcript(company, link_info, force_update),
+                transcript_links[:4]
+            ))
+        
+        return [path for path in saved_files if path]
+    
+    def _scrape_transcript(self, company: str, link_info: Dict, force_update: bool) -> Optional[str]:
+        """Download one transcript and save it. Returns the saved file path."""
+        url = link_info['url']
+        quarter = link_info['quarter']
         
-        # Find all links that might be transcripts
-        transcript_links = self._find_transcript_links(soup, base_url)
-        logger.info(f"Found {len(transcript_links)} potential transcript links")
+        # Skip if quarter is unknown
+        if quarter.lower() == 'unknown':
+            logger.info(f"Skipping - couldn't extract quarter info from link")
+            return None
         
-        saved_files = []
-        for i, link_info in enumerate(transcript_links[:4], 1):  # Get last 4 quarters
-            url = link_info['url']
-            quarter = link_info['quarter']
+        # Checked before downloading, so known quarters cost no network or parsing
+        filepath = self._transcript_path(company, quarter)
+        if filepath.exists() and not force_update:
+            logger.info(f"Skipping {quarter} (already exists)")
+            return None
+        
+        logger.info(f"Downloading {quarter}: {url}")
+        
+        try:
+            if url.endswith('.pdf'):
+                text = self._download_and_extract_pdf(url, company, quarter)
+            else:
+                text = self._scrape_html_transcript(url)
             
-            # Skip if quarter is unknown
-            if quarter.lower() == 'unknown':
-                logger.info(f"Skipping - couldn't extract quarter info from link")
-                continue
+            if not text:
+                return None
             
-            logger.info(f"Downloading {quarter}: {url}")
+            # Create company subfolder
+            filepath.parent.mkdir(parents=True, exist_ok=True)
             
-            try:
-                if url.endswith('.pdf'):
-                    text = self._download_and_extract_pdf(url, company, quarter)
-                else:
-                    text = self._scrape_html_transcript(url)
-                
-                if text:
-                    # Create company subfolder
-                    company_folder = self.output_dir / company.lower()
-                    company_folder.mkdir(parents=True, exist_ok=True)
-                    
-                    clean_quarter = quarter.lower().replace(' ', '_')
-                    clean_quarter = re.sub(r'fy20(\d{2})', r'fy\1', clean_quarter)
-                    clean_quarter = re.sub(r'(q\d)fy20(\d{2})', r'\1_fy\2', clean_quarter)
-                    
-                    filename = f"{company.lower()}_{clean_quarter}.txt"
-                    filepath = company_folder / filename
-                    
-                    if filepath.exists() and not force_update:
-                        logger.info(f"Skipping {quarter} (already exists)")
-                        continue
-                    
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(text)
-                    
-                    saved_files.append(str(filepath))
-                    logger.info(f"SUCCESS: Saved: {filename}")
-                
-                time.sleep(2)
+            # Two links can map to the same quarter file
+            with self._write_lock:
+                if filepath.exists() and not force_update:
+                    logger.info(f"Skipping {quarter} (already exists)")
+                    return None
                 
-            except Exception as e:
-                logger.error(f"Failed to process {quarter}: {e}")
-                continue
-        
-        return saved_files
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    f.write(text)
+            
+            logger.info(f"SUCCESS: Saved: {filepath.name}")
+            return str(filepath)
+            
+        except Exception as e:
+            logger.error(f"Failed to process {quarter}: {e}")
+            return None
     
     def _find_transcript_links(self, soup: BeautifulSoup, base_url: str) -> List[Dict]:
         """
@@ -167,14 +346,13 @@ class TranscriptScraper:
         """
         links = []
         
-        keywords = ['transcript', 'earnings', 'call', 'quarterly', 'results']
-        
-        for a_tag in soup.find_all('a', href=True):
+        # soup only holds <a href> tags (parsed with _LINKS_ONLY)
+        for a_tag in soup.find_all('a'):
             href = a_tag['href']
             text = a_tag.get_text().lower()
             
             # Check if link is relevant
-            if any(keyword in text or keyword in href.lower() for keyword in keywords):
+            if _LINK_RE.search(text) or _LINK_RE.search(href):
                 # Make absolute URL
                 if href.startswith('http'):
                     full_url = href
@@ -196,16 +374,8 @@ class TranscriptScraper:
     
     def _extract_quarter_info(self, text: str) -> Optional[str]:
         """Extract quarter information from text."""
-        # Look for patterns like "Q1 2026", "Q4 FY25", "q3 fy2025" etc.
-        patterns = [
-            r'Q[1-4]\s*(?:FY)?\s*20\d{2}',
-            r'Q[1-4]\s*(?:Fiscal)?\s*20\d{2}',
-            r'(First|Second|Third|Fourth)\s*Quarter\s*20\d{2}',
-            r'q[1-4]\s*fy\s*20\d{2}'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in _QUARTER_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(0)
         
@@ -215,52 +385,65 @@ class TranscriptScraper:
         """Download PDF and extract text."""
         logger.info(f"  Extracting PDF: {url}")
         
-        # Download PDF
-        response = requests.get(url, headers=self.headers, timeout=30)
-        response.raise_for_status()
-        
-        # Save PDF
         pdf_filename = f"{company}_{quarter.lower().replace(' ', '_')}.pdf"
         pdf_path = self.pdf_dir / pdf_filename
         
-        with open(pdf_path, 'wb') as f:
-            f.write(response.content)
+        # Stream the PDF straight to disk instead of holding it all in memory
+        with self._host_slot(url), self.session.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            with open(pdf_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=PDF_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
         
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                
-                text = self._clean_text(text)
-                return text
-                
-        except Exception as e:
-            logger.error(f"pdfplumber failed, trying PyPDF2: {e}")
-            
+        # PyMuPDF (MuPDF C engine) is much faster; the others are fallbacks
+        extractors = [
+            ("PyMuPDF", self._extract_pdf_pymupdf),
+            ("pdfplumber", self._extract_pdf_pdfplumber),
+            ("PyPDF2", self._extract_pdf_pypdf2)
+        ]
+        for name, extract in extractors:
             try:
-                with open(pdf_path, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                    
-                    text = self._clean_text(text)
-                    return text
-            except Exception as e2:
-                logger.error(f"PyPDF2 also failed: {e2}")
-                return ""
+                return self._clean_text(extract(pdf_path))
+            except Exception as e:
+                logger.error(f"{name} failed: {e}")
+        
+        return ""
+    
+    def _extract_pdf_pymupdf(self, pdf_path: Path) -> str:
+        with pymupdf.open(pdf_path) as doc:
+            return "\n".join(page.get_text("text") for page in doc)
+    
+    def _extract_pdf_pdfplumber(self, pdf_path: Path) -> str:
+        # No laparams: pdfplumber then skips pdfminer's layout analysis entirely,
+        # which is all we want for plain text
+        with pdfplumber.open(pdf_path) as pdf:
+            parts = []
+            for page in pdf.pages:
+                page_text = page.extract_text(x_tolerance=3, y_tolerance=3)
+                # Drop the page's cached chars/objects so memory stays flat
+                page.flush_cache()
+                if page_text:
+                    parts.append(page_text)
+            return "\n".join(parts)
+    
+    def _extract_pdf_pypdf2(self, pdf_path: Path) -> str:
+        with open(pdf_path, 'rb') as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            parts = []
+            for page in pdf_reader.pages:
+                page_text = page.extract_text()
+                if page_text:
+                    parts.append(page_text)
+            return "\n".join(parts)
     
     def _scrape_html_transcript(self, url: str) -> str:
         """Scrape transcript from HTML page."""
-        response = requests.get(url, headers=self.headers, timeout=30)
+        with self._host_slot(url):
+            response = self.session.get(url, timeout=30)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = BeautifulSoup(response.content, 'lxml',
+                             from_encoding=self._declared_encoding(response))
         
         # Remove script and style elements
         for element in soup(['script', 'style', 'nav', 'footer', 'header']):
@@ -274,21 +457,21 @@ class TranscriptScraper:
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text."""
-        text = re.sub(r'\s+', ' ', text)
+        text = _WS_RE.sub(' ', text)
         
-        text = re.sub(r'Page \d+', '', text)
+        text = _PAGE_RE.sub('', text)
         
-        text = re.sub(r'[^\x00-\x7F]+', '', text)  # Remove non-ASCII
+        # Remove non-ASCII (C-level filter; same result as deleting [^\x00-\x7F]+)
+        text = text.encode('ascii', 'ignore').decode('ascii')
         
         return text.strip()
 
 
 def main():
     """Run the scraper."""
-    scraper = TranscriptScraper()
-    
     # Scrape all companies
-    results = scraper.scrape_all_companies(force_update=False)
+    with TranscriptScraper() as scraper:
+        results = scraper.scrape_all_companies(force_update=False)
     
     # Print summary
     print("\n" + "="*60)
@@ -1,101 +1,211 @@
+import asyncio
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import faiss
 import numpy as np
-import json
+from rag_pipeline_v3 import CloudRAGSystem
 
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-print("Loading saved embeddings...\n")
+# Let FAISS search kernels use every core
+faiss.omp_set_num_threads(os.cpu_count() or 1)
 
-# Load saved data
-index = faiss.read_index("faiss_index.bin")
-chunks = np.load("chunks.npy", allow_pickle=True).tolist()
-with open("metadata.json", "r") as f:
-    metadata = json.load(f)
+# Search beam for filtered HNSW searches (a filter hides most graph neighbours)
+HNSW_FILTERED_EF_SEARCH = 128
+# Inverted lists visited per query if the index is IVF
+IVF_NPROBE = 8
 
-companies = sorted(set(m['company'] for m in metadata))
-print(f"Loaded {index.ntotal} vectors from {len(companies)} companies: {', '.join(companies)}")
-print(f"Each question costs ~$0.005 (half a cent)\n")
+@lru_cache(maxsize=1)
+def _load():
+    # Loaded on first use (not at import), then kept for the process
+    print("Loading saved embeddings...\n")
+    
+    # Same files and loader as the API (index + segments, chunk store,
+    # metadata), memory-mapped, without embedding anything new
+    rag = CloudRAGSystem(mmap_index=True, load_only=True)
+    
+    return {
+        'index': rag.index,
+        'chunks': rag.chunks,
+        'metadata': rag.chunk_metadata,
+        'companies': sorted(set(rag.chunk_metadata.companies.tolist())),
+        # One FAISS ID selector per company (IDSelectorBatch: O(1) membership)
+        'company_selectors': rag.company_selectors,
+        'no_match_selector': rag.no_match_selector
+    }
 
-def ask_question(question, company_filter=None):
+def _normalize_question(question):
+    # Collapse whitespace so trivially different inputs share a cache entry
+    return " ".join(question.split())
+
+@lru_cache(maxsize=1024)
+def _embed(question):
     q_response = client.embeddings.create(
         model="text-embedding-3-small",
         input=question
     )
-    q_embedding = np.array([q_response.data[0].embedding]).astype('float32')
+    # Straight to a (1, D) C-contiguous float32 array (no float64 intermediate)
+    q_embedding = np.asarray(q_response.data[0].embedding, dtype=np.float32)[None, :]
+    q_embedding.setflags(write=False)  # shared by every cache hit
+    return q_embedding
+
+def _embed_batch(questions):
+    # One embeddings request for all questions
+    q_response = client.embeddings.create(
+        model="text-embedding-3-small",
+        input=questions
+    )
+    return _embedding_rows(q_response)
+
+def _embedding_rows(q_response):
+    embeddings = np.asarray([item.embedding for item in q_response.data], dtype=np.float32)
+    return [embeddings[i:i + 1] for i in range(len(embeddings))]
+
+def ask_question(question, company_filter=None):
+    return _answer(question, _embed(_normalize_question(question)), company_filter)
+
+def ask_questions(questions, company_filter=None):
+    questions = [_normalize_question(q) for q in questions]
+    return [_answer(q, q_embedding, company_filter)
+            for q, q_embedding in zip(questions, _embed_batch(questions))]
+
+async def ask_question_async(question, company_filter=None):
+    # Cached embedding lookup runs in a thread so gathered questions overlap
+    q_embedding = await asyncio.to_thread(_embed, _normalize_question(question))
+    # Async client per call: its connection pool is bound to the running event loop
+    async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) as aclient:
+        return await _answer_async(question, q_embedding, company_filter, aclient)
+
+async def ask_questions_async(questions, company_filter=None):
+    # One embeddings request, then every search + chat call runs concurrently
+    questions = [_normalize_question(q) for q in questions]
+    await asyncio.to_thread(_load)  # load once, not in every gathered task
+    # One client shared by the gathered calls, closed before the loop ends
+    async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) as aclient:
+        q_response = await aclient.embeddings.create(
+            model="text-embedding-3-small",
+            input=questions
+        )
+        return await asyncio.gather(*[
+            _answer_async(q, q_embedding, company_filter, aclient)
+            for q, q_embedding in zip(questions, _embedding_rows(q_response))
+        ])
+
+def _search_params(index, selector):
+    # The parameter class has to match the index type
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_FILTERED_EF_SEARCH)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+def _retrieve(q_embedding, company_filter=None):
+    # Unit-length query: cosine == inner product, and the L2 ranking over the
+    # (already unit-length) OpenAI document vectors is unchanged
+    q_embedding = np.array(q_embedding, dtype='float32')
+    faiss.normalize_L2(q_embedding)
     
-    k = 50 if company_filter else 6
-    distances, indices = index.search(q_embedding, k)
+    data = _load()
+    index, chunks, metadata = data['index'], data['chunks'], data['metadata']
     
     if company_filter:
-        filtered_results = []
-        for idx in indices[0]:
-            if metadata[idx]["company"].lower() == company_filter.lower():
-                filtered_results.append(idx)
-                if len(filtered_results) >= 6:
-                    break
-        result_indices = filtered_results
+        # Only this company's vectors are considered inside the FAISS search,
+        # so k=6 is enough (no over-fetching and filtering afterwards)
+        selector = data['company_selectors'].get(company_filter.lower(), data['no_match_selector'])
+        distances, indices = index.search(q_embedding, 6, params=_search_params(index, selector))
     else:
-        result_indices = indices[0][:6]
+        distances, indices = index.search(q_embedding, 6)
+    
+    # -1 pads the result when fewer than 6 vectors match
+    result_indices = indices[0][indices[0] >= 0]
     
     context_chunks = []
-    sources = []
+    sources = {}  # insertion-ordered set: best-ranked source first
     for idx in result_indices:
         context_chunks.append(chunks[idx])
-        sources.append(f"{metadata[idx]['company']} - {metadata[idx]['filename']}")
+        if len(sources) < 3:
+            sources[f"{metadata.companies[idx]} - {metadata.quarters[idx]} {metadata.fiscal_years[idx]}"] = None
     
-    context = "\n\n".join(context_chunks)
+    return "\n\n".join(context_chunks), list(sources)
+
+def _messages(question, context):
+    return [
+        {"role": "system", "content": "You are analyzing earnings call transcripts from multiple companies. Answer based only on the provided context. When relevant, mention which company you're referring to."},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
+    ]
+
+def _answer(question, q_embedding, company_filter=None):
+    context, sources = _retrieve(q_embedding, company_filter)
     
     response = client.chat.completions.create(
         model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are analyzing earnings call transcripts from multiple companies. Answer based only on the provided context. When relevant, mention which company you're referring to."},
-            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
-        ],
+        messages=_messages(question, context),
         temperature=0
     )
     
-    return response.choices[0].message.content, list(set(sources))[:3]
-
-print("=" * 60)
-print(" INTERACTIVE MULTI-COMPANY Q&A")
-print("=" * 60)
-print("\nCommands:")
-print("  - Just type your question for cross-company analysis")
-print("  - Type 'filter:salesforce' before question to filter by company")
-print("  - Type 'quit' to exit\n")
-print("Example questions:")
-print("  - Compare AI strategies across companies")
-print("  - filter:microsoft What is Azure's revenue growth?")
-print("  - What are the biggest challenges mentioned?")
-print("  - Which company is most bullish on AI?\n")
-
-question_count = 0
-while True:
-    user_input = input("Your question: ")
+    return response.choices[0].message.content, sources
+
+async def _answer_async(question, q_embedding, company_filter, aclient):
+    # FAISS search is CPU-bound; a thread lets it overlap pending HTTPS calls
+    context, sources = await asyncio.to_thread(_retrieve, q_embedding, company_filter)
     
-    if user_input.lower() in ['quit', 'exit', 'q']:
-        print(f"\nAsked {question_count} questions. Total cost: ~${question_count * 0.005:.3f}")
-        break
+    response = await aclient.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=_messages(question, context),
+        temperature=0
+    )
     
-    # Check for company filter
-    company_filter = None
-    if user_input.lower().startswith("filter:"):
-        parts = user_input.split(" ", 1)
-        if len(parts) == 2:
-            company_filter = parts[0].replace("filter:", "").strip()
-            question = parts[1]
-        else:
-            print("Invalid filter format. Use: filter:company Your question here")
-            continue
-    else:
-        question = user_input
+    return response.choices[0].message.content, sources
+
+def main():
+    data = _load()
+    companies = data['companies']
+    print(f"Loaded {data['index'].ntotal} vectors from {len(companies)} companies: {', '.join(companies)}")
+    print(f"Each question costs ~$0.005 (half a cent)\n")
+    
+    print("=" * 60)
+    print(" INTERACTIVE MULTI-COMPANY Q&A")
+    print("=" * 60)
+    print("\nCommands:")
+    print("  - Just type your question for cross-company analysis")
+    print("  - Type 'filter:salesforce' before question to filter by company")
+    print("  - Type 'quit' to exit\n")
+    print("Example questions:")
+    print("  - Compare AI strategies across companies")
+    print("  - filter:microsoft What is Azure's revenue growth?")
+    print("  - What are the biggest challenges mentioned?")
+    print("  - Which company is most bullish on AI?\n")
     
-    print("-" * 60)
-    answer, sources = ask_question(question, company_filter)
-    print(f"{answer}")
-    print(f"Sources: {', '.join(sources)}\n")
-    question_count += 1
\ No newline at end of file
+    question_count = 0
+    while True:
+        user_input = input("Your question: ")
+        
+        if user_input.lower() in ['quit', 'exit', 'q']:
+            print(f"\nAsked {question_count} questions. Total cost: ~${question_count * 0.005:.3f}")
+            break
+        
+        # Check for company filter
+        company_filter = None
+        if user_input.lower().startswith("filter:"):
+            parts = user_input.split(" ", 1)
+            if len(parts) == 2:
+                company_filter = parts[0].replace("filter:", "").strip()
+                question = parts[1]
+            else:
+                print("Invalid filter format. Use: filter:company Your question here")
+                continue
+        else:
+            question = user_input
+        
+        print("-" * 60)
+        answer, sources = ask_question(question, company_filter)
+        print(f"{answer}")
+        print(f"Sources: {', '.join(sources)}\n")
+        question_count += 1
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,30 @@ rag_pipeline_v3.py
 Improved RAG pipeline with INCREMENTAL embedding updates.
 """
 
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI, RateLimitError
 import faiss
+import tiktoken
 import numpy as np
 import json
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 from database import TranscriptDatabase
+from chunk_store import ChunkMetadata, ChunkStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process index lock, so run a single API worker there
+    fcntl = None
 
 # Load .env from config folder
 config_path = Path(__file__).parent.parent / "config" / ".env"
@@ -20,29 +35,143 @@ load_dotenv(config_path)
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+@lru_cache(maxsize=None)
+def _token_encoder(model: str) -> tiktoken.Encoding:
+    """Tokenizer for a model (loaded on first use, then kept)."""
+    return tiktoken.encoding_for_model(model)
+
+class _RateLimiter:
+    """
+    Token bucket over requests and tokens per minute, refilled continuously.
+    Callers wait before sending instead of being answered with 429s.
+    Used from a single event loop, so no locking is needed.
+    """
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.last_refill = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed * self.tokens_per_minute / 60)
+        self.last_refill = now
+    
+    async def acquire(self, tokens: int):
+        """Wait until one request of this many tokens fits in both budgets."""
+        # A request larger than the whole bucket can only wait for a full one
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return
+            await asyncio.sleep(max(
+                (1 - self.available_requests) * 60 / self.requests_per_minute,
+                (tokens - self.available_tokens) * 60 / self.tokens_per_minute
+            ))
+
 class CloudRAGSystem:
     
-    def __init__(self):
+    def __init__(self, mmap_index: bool = False, load_only: bool = False,
+                 db: Optional[TranscriptDatabase] = None):
+        """
+        mmap_index memory-maps the FAISS index instead of reading it into RAM,
+        so several API worker processes can share its pages.
+        load_only loads the saved index without embedding anything new (for
+        read-only clients such as query_interactive.py).
+        db reuses an open database (and its connection pool) instead of
+        opening data/transcripts.db.
+        """
+        self.mmap_index = mmap_index
+        self.load_only = load_only
+        
         # Define paths relative to project root
         project_root = Path(__file__).parent.parent
         data_dir = project_root / "data"
         
         # Initialize with organized paths
-        self.db = TranscriptDatabase(str(data_dir / "transcripts.db"))
+        self.db = db or TranscriptDatabase(str(data_dir / "transcripts.db"))
         self.faiss_index_path = str(data_dir / "faiss_index.bin")
-        self.chunks_path = str(data_dir / "chunks.npy")
-        self.metadata_path = str(data_dir / "metadata.json")
+        # Vectors added since faiss_index.bin was last written: one segment
+        # file per incremental save, named by the FAISS position it starts at
+        self.faiss_segments_dir = data_dir / "faiss_segments"
+        self.chunks_path = str(data_dir / "chunks.bin")
+        self.chunk_offsets_path = str(data_dir / "chunks.offsets.npy")
+        self.legacy_chunks_path = str(data_dir / "chunks.npy")  # pickled, pre-ChunkStore
+        # Question embeddings, shared across processes and restarts
+        self.question_cache_dir = data_dir / "qcache"
+        self.metadata_path = str(data_dir / "metadata.npz")
+        self.legacy_metadata_path = str(data_dir / "metadata.json")  # pre-columnar
+        # Vector count and newest transcript id covered by the saved index
+        self.manifest_path = str(data_dir / "index_manifest.json")
+        # Held while the saved index is loaded, updated or rebuilt, so API
+        # workers starting together don't all embed the same new transcripts
+        self.index_lock_path = str(data_dir / "index.lock")
+        # Manifest mtime when the index was loaded (see index_changed_on_disk)
+        self.loaded_manifest_mtime: Optional[int] = None
         
         self.index = None
-        self.chunks = []
-        self.chunk_metadata = []
+        self.index_base_ntotal = 0  # vectors in faiss_index.bin itself
+        self.chunks = ChunkStore(self.chunks_path, self.chunk_offsets_path)
+        self.chunk_metadata = ChunkMetadata()
+        
+        # Lowercased company -> FAISS positions of its chunks, and a search
+        # filter (IDSelectorBatch) per company, rebuilt whenever vectors change
+        self.company_to_ids: Dict[str, np.ndarray] = {}
+        self.company_selectors: Dict[str, faiss.IDSelector] = {}
+        self.no_match_selector = faiss.IDSelectorBatch(np.empty(0, dtype=np.int64))
         
         self.embedding_model = "text-embedding-3-small"
         self.generation_model = "gpt-4o-mini"
+        # Chunks sent per embeddings request (the API accepts up to 2048 inputs)
+        self.embed_batch_size = 512
+        # Token budget per embeddings request (the API caps a request at 300k)
+        self.embed_batch_max_tokens = 250_000
+        # New chunks embedded and saved per step of an incremental update
+        self.embed_window_size = 8192
+        # Embedding batches in flight at once (lower it on low rate-limit tiers)
+        self.embed_max_concurrency = 35
+        # Account rate limits for the embedding model, enforced client-side,
+        # and retries (exponential backoff) if a 429 still comes back
+        self.embed_requests_per_minute = 3000
+        self.embed_tokens_per_minute = 1_000_000
+        self.embed_max_retries = 5
+        
+        # HNSW graph parameters (M neighbours per node, build/search beam widths);
+        # vectors are unit-length (inner product == cosine similarity) and
+        # stored scalar-quantized: QT_8bit is 1 B/dim (4x smaller than float32),
+        # QT_fp16 is 2 B/dim for near-lossless scores
+        self.hnsw_sq_type = faiss.ScalarQuantizer.QT_8bit
+        self.hnsw_m = 32
+        self.hnsw_ef_construction = 200
+        self.hnsw_ef_search = 64
+        # Company-filtered searches skip most graph neighbours, so search wider
+        self.hnsw_filtered_ef_search = 128
+        # Incremental adds go to segment files until they hold this fraction
+        # of the base index; then the whole index is rewritten (compaction)
+        self.delta_compact_ratio = 0.1
+        
+        # Recently embedded questions kept in memory (LRU), in front of qcache/
+        self.question_cache_size = 1024
+        self._question_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._question_cache_lock = threading.Lock()
+        
+        # Hybrid retrieval: FTS5 transcripts considered, and the RRF constant
+        self.keyword_search_limit = 10
+        self.rrf_k = 60
         
         # Cost tracking
         self.embedding_cost_per_token = 0.02 / 1_000_000
         self.generation_cost_input = 0.15 / 1_000_000
+        self.generation_cost_cached_input = 0.075 / 1_000_000  # prompt-cache hits
         self.generation_cost_output = 0.60 / 1_000_000
         self.total_cost = 0.0
         
@@ -50,80 +179,238 @@ class CloudRAGSystem:
         self._load_or_update_embeddings()
     
     def _load_or_update_embeddings(self):
-        
-        if Path(self.faiss_index_path).exists():
-            print("Loading existing FAISS index from disk (FREE!)...")
-            self._load_existing_embeddings()
-            
-            # Check for new transcripts
-            db_chunks = self.db.get_stats()['total_chunks']
-            faiss_chunks = self.index.ntotal
+        """Load the saved index, embedding new transcripts first; builds it on the first run."""
+        with self._index_lock():
+            # (Re)open the chunk store under the lock: another process may have
+            # appended to it while this one waited
+            self.chunks = ChunkStore(self.chunks_path, self.chunk_offsets_path)
+            loaded = False
+            if Path(self.faiss_index_path).exists():
+                print("Loading existing FAISS index from disk (FREE!)...")
+                loaded = self._load_existing_embeddings()
+                if not loaded:
+                    print(" Saved index, chunks and metadata don't match (interrupted rebuild?)")
             
-            if db_chunks > faiss_chunks:
-                print(f"\n Found {db_chunks - faiss_chunks} new chunks in database!")
-                print("   Adding incremental embeddings (only paying for new data)...\n")
-                self._add_new_embeddings()
-            elif db_chunks < faiss_chunks:
-                print(f"\n Database has fewer chunks than FAISS!")
-                print(f"   DB: {db_chunks}, FAISS: {faiss_chunks}")
-                print("   Consider running cleanup or rebuild.")
+            if loaded and self.load_only:
+                print(f" Loaded {self.index.ntotal} vectors")
+            elif self.load_only:
+                raise RuntimeError("No usable saved FAISS index; run rag_pipeline_v3.py to build it")
+            elif loaded:
+                # Check for new transcripts: one MAX(id) instead of aggregate stats
+                manifest = self._read_manifest()
+                faiss_chunks = self.index.ntotal
+                
+                # No manifest (index saved before manifests existed): let
+                # _add_new_embeddings work out what is missing; it writes one
+                if manifest is None or self.db.get_max_transcript_id() > manifest['max_transcript_id']:
+                    print(f"\n Checking database for transcripts added since the last index update...")
+                    print("   Adding incremental embeddings (only paying for new data)...\n")
+                    self._add_new_embeddings()
+                elif manifest['ntotal'] != faiss_chunks:
+                    print(f"\n Manifest and FAISS index disagree!")
+                    print(f"   Manifest: {manifest['ntotal']}, FAISS: {faiss_chunks}")
+                    print("   Consider running cleanup or rebuild.")
+                else:
+                    companies = len(np.unique(self.chunk_metadata.company_lower))
+                    print(f" Loaded {faiss_chunks} vectors from {companies} companies")
             else:
-                print(f" Loaded {faiss_chunks} vectors from {self.db.get_stats()['total_companies']} companies")
-        else:
-            print(" No FAISS index found. Creating embeddings from scratch...")
-            self._create_all_embeddings()
+                print(" No usable FAISS index found. Creating embeddings from scratch...")
+                self._create_all_embeddings()
+            
+            self._build_company_selectors()
+            self.loaded_manifest_mtime = self._manifest_mtime()
     
-    def _load_existing_embeddings(self):
-        self.index = faiss.read_index(self.faiss_index_path)
-        self.chunks = np.load(self.chunks_path, allow_pickle=True).tolist()
-        
-        with open(self.metadata_path, "r") as f:
-            self.chunk_metadata = json.load(f)
+    @contextmanager
+    def _index_lock(self):
+        """Exclusive lock on the saved index files, shared by every process using them."""
+        if fcntl is None:
+            yield
+            return
+        Path(self.index_lock_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.index_lock_path, "a") as lock_file:
+            # Released when the file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+    
+    def _manifest_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def index_changed_on_disk(self) -> bool:
+        """
+        True once another process (or another CloudRAGSystem) has saved a
+        newer index than the one loaded here; every update and rebuild ends
+        by rewriting the manifest.
+        """
+        return self._manifest_mtime() != self.loaded_manifest_mtime
+    
+    def _build_company_selectors(self):
+        """Index chunk positions by company for filtered FAISS searches."""
+        company_ids = self.chunk_metadata.company_lower
+        company_to_ids = {
+            str(company): np.flatnonzero(company_ids == company)
+            for company in np.unique(company_ids)
+        }
+        self.company_selectors = {
+            company: faiss.IDSelectorBatch(ids)
+            for company, ids in company_to_ids.items()
+        }
+        self.company_to_ids = company_to_ids
+    
+    def _load_existing_embeddings(self) -> bool:
+        """
+        Load the saved index, chunk texts and metadata.
+        metadata.npz is written last by every save, so it records what was
+        committed: chunk texts and segment vectors past it (left by an
+        interrupted update) are dropped. Returns False if the files can't be
+        matched up that way; they then have to be rebuilt.
+        """
+        io_flags = faiss.IO_FLAG_MMAP if self.mmap_index else 0
+        self.index = faiss.read_index(self.faiss_index_path, io_flags)
+        self.index_base_ntotal = self.index.ntotal
+        if len(self.chunks) == 0 and Path(self.legacy_chunks_path).exists():
+            print(" Converting chunks.npy to the memory-mapped chunk store...")
+            self.chunks.replace(np.load(self.legacy_chunks_path, allow_pickle=True).tolist())
+        
+        if Path(self.metadata_path).exists():
+            self.chunk_metadata = ChunkMetadata.load(self.metadata_path)
+        elif Path(self.legacy_metadata_path).exists():
+            with open(self.legacy_metadata_path, "r") as f:
+                legacy_metadata = ChunkMetadata.from_records(json.load(f))
+            # Only valid for the chunks it was saved with
+            if len(legacy_metadata) != len(self.chunks):
+                return False
+            print(" Converting metadata.json to columnar metadata.npz...")
+            self.chunk_metadata = legacy_metadata
+            self.chunk_metadata.save(self.metadata_path)
+        else:
+            return False
+        
+        committed = len(self.chunk_metadata)
+        if self.index_base_ntotal > committed or len(self.chunks) < committed:
+            return False
+        if len(self.chunks) > committed:
+            print(f" Dropping {len(self.chunks) - committed} chunks of an interrupted update...")
+            self.chunks.truncate(committed)
+        
+        for segment in self._read_segments(committed):
+            self.index.add(segment)
+        if self.index.ntotal != committed:
+            return False
+        
+        if (not isinstance(self.index, faiss.IndexHNSW) or
+                self.index.metric_type != faiss.METRIC_INNER_PRODUCT):
+            self._migrate_index()
+        self.index.hnsw.efSearch = self.hnsw_ef_search
+        return True
     
     def _add_new_embeddings(self):
         """
         Incremental updates!
         """
         
+        # Records written before metadata carried transcript_id are -1; the
+        # database's chunk mappings know which transcript those chunks came from
+        missing = self.chunk_metadata.transcript_ids == -1
+        if missing.any():
+            mapped_ids = self.db.get_transcript_ids_by_faiss_position(len(self.chunk_metadata))
+            self.chunk_metadata.transcript_ids[missing] = mapped_ids[missing]
+            self.chunk_metadata.save(self.metadata_path)
+        
         # Get all transcript IDs that already have embeddings
-        embedded_transcript_ids = set()
-        for meta in self.chunk_metadata:
-            # Metadata has transcript_id from database
-            if 'transcript_id' in meta:
-                embedded_transcript_ids.add(meta['transcript_id'])
+        # (-1 is left only for chunks the database has no mapping for)
+        embedded_transcript_ids = set(self.chunk_metadata.transcript_ids.tolist())
+        embedded_transcript_ids.discard(-1)
         
         print(f" Already embedded: {len(embedded_transcript_ids)} transcripts")
         
         # Find transcripts in DB that aren't embedded yet
-        all_transcripts = []
-        for company in self.db.get_all_companies():
-            all_transcripts.extend(self.db.get_transcripts_by_company(company))
+        all_transcripts = [transcript
+                           for transcripts in self._transcripts_by_company(self.db.get_all_companies())
+                           for transcript in transcripts]
         
         new_transcripts = [t for t in all_transcripts 
                           if t['id'] not in embedded_transcript_ids]
         
+        max_transcript_id = max((t['id'] for t in all_transcripts), default=0)
+        
         if not new_transcripts:
             print(" No new transcripts to embed")
+            self._save_manifest(max_transcript_id)
             return
         
         print(f" Found {len(new_transcripts)} new transcripts to embed:")
         for t in new_transcripts:
             print(f"   • {t['company']} {t['quarter']} {t['fiscal_year']}")
         
-        # Embed only new transcripts
-        new_chunks = []
-        new_metadata = []
+        # Embed only new transcripts, one window at a time: each window is
+        # committed (metadata.npz saved) before the next is chunked, so an
+        # interrupted run resumes with the transcripts that are still missing
+        total_tokens = 0
+        for new_chunks, new_metadata in self._chunk_windows(new_transcripts):
+            print(f"\n Creating embeddings for {len(new_chunks)} new chunks...")
+            
+            # Generate embeddings for new chunks only
+            new_embeddings_array, window_tokens = self._embed_texts(new_chunks)
+            total_tokens += window_tokens
+            
+            faiss.normalize_L2(new_embeddings_array)
+            
+            starting_faiss_position = self.index.ntotal
+            
+            self.index.add(new_embeddings_array)
+            print(f" Added {len(new_embeddings_array)} vectors to FAISS")
+            
+            self.chunks.append(new_chunks)
+            self._save_new_vectors(new_embeddings_array)
+            
+            # Update database with new chunk mappings (rewritten per transcript,
+            # so repeating them after an interrupted window is harmless)
+            new_rows = ChunkMetadata.from_records(new_metadata)
+            self._save_chunk_mappings(new_chunks, new_rows.transcript_ids, starting_faiss_position)
+            
+            # Saved last: this commits the window (see _load_existing_embeddings)
+            self.chunk_metadata.extend(new_rows)
+            self.chunk_metadata.save(self.metadata_path)
+            self._compact_segments()
+            
+            print(f" Saved updated embeddings")
+            
+            # Update metadata
+            existing_cost = self.db.get_metadata("last_embedding_cost") or 0.0
+            self.db.set_metadata("last_embedding_cost",
+                                 existing_cost + window_tokens * self.embedding_cost_per_token)
+        
+        self._save_manifest(max_transcript_id)
+        
+        # Calculate cost
+        embedding_cost = total_tokens * self.embedding_cost_per_token
+        print(f"\n Incremental embedding cost: ${embedding_cost:.4f} ({total_tokens:,} tokens)")
+        
+        print(f" Database updated with {len(new_transcripts)} new transcript mappings\n")
+    
+    def _chunk_windows(self, transcripts: List[Dict]) -> Iterator[Tuple[List[str], List[Dict]]]:
+        """
+        Chunk transcripts lazily, yielding (chunks, metadata records) for runs
+        of whole transcripts of at least embed_window_size chunks (the last
+        may be smaller), so only one window of chunk text is in memory.
+        """
+        window_chunks = []
+        window_metadata = []
         
-        for transcript in new_transcripts:
+        for transcript in transcripts:
             print(f"\n Processing: {transcript['company']} {transcript['quarter']} {transcript['fiscal_year']}")
             
-            # Chunk the transcript
-            chunks = self._chunk_text(transcript['raw_text'])
-            new_chunks.extend(chunks)
+            # Chunk the transcript (listing rows don't carry raw_text)
+            raw_text = self.db.get_transcript_text(transcript['id'])
+            chunks = self._chunk_text(raw_text)
+            window_chunks.extend(chunks)
             
             # Store metadata
             for chunk in chunks:
-                new_metadata.append({
+                window_metadata.append({
                     'transcript_id': transcript['id'],
                     'company': transcript['company'],
                     'quarter': transcript['quarter'],
@@ -131,66 +418,96 @@ class CloudRAGSystem:
                 })
             
             print(f" Created {len(chunks)} chunks")
-        
-        print(f"\n Creating embeddings for {len(new_chunks)} new chunks...")
-        
-        # Generate embeddings for new chunks only
-        new_embeddings = []
-        total_tokens = 0
-        
-        for i, chunk in enumerate(new_chunks):
-            response = client.embeddings.create(
-                model=self.embedding_model,
-                input=chunk
-            )
-            new_embeddings.append(response.data[0].embedding)
-            total_tokens += response.usage.total_tokens
-            
-            if (i + 1) % 50 == 0:
-                print(f"   Embedded {i+1}/{len(new_chunks)} chunks...")
-        
-        # Calculate cost
-        embedding_cost = total_tokens * self.embedding_cost_per_token
-        print(f"\n Incremental embedding cost: ${embedding_cost:.4f} ({total_tokens:,} tokens)")
-        
-        new_embeddings_array = np.array(new_embeddings).astype('float32')
-        
-        starting_faiss_position = self.index.ntotal
-        
-        self.index.add(new_embeddings_array)
-        print(f" Added {len(new_embeddings)} vectors to FAISS")
-        
-        self.chunks.extend(new_chunks)
-
-        self.chunk_metadata.extend(new_metadata)
-        
-        faiss.write_index(self.index, self.faiss_index_path)
-        np.save(self.chunks_path, np.array(self.chunks, dtype=object))
-        with open(self.metadata_path, "w") as f:
-            json.dump(self.chunk_metadata, f)
-        
-        print(f" Saved updated embeddings")
-        
-        # Update database with new chunk mappings
-        for transcript in new_transcripts:
-            transcript_chunks = [chunk for chunk, meta in zip(new_chunks, new_metadata)
-                               if meta['transcript_id'] == transcript['id']]
             
-            chunk_count = sum(1 for meta in new_metadata 
-                            if meta['transcript_id'] == transcript['id'])
-            faiss_positions = list(range(starting_faiss_position, 
-                                        starting_faiss_position + chunk_count))
-            starting_faiss_position += chunk_count
-            
-            self.db.insert_embedding_chunks(transcript['id'], 
-                                          transcript_chunks, 
-                                          faiss_positions)
+            if len(window_chunks) >= self.embed_window_size:
+                yield window_chunks, window_metadata
+                window_chunks = []
+                window_metadata = []
         
-        # Update metadata
-        existing_cost = self.db.get_metadata("last_embedding_cost") or 0.0
-        self.db.set_metadata("last_embedding_cost", existing_cost + embedding_cost)
+        if window_chunks:
+            yield window_chunks, window_metadata
+    
+    def _migrate_index(self):
+        """
+        Rebuild an index saved by older versions (exact IndexFlatL2 search,
+        or HNSW with the L2 metric) as inner-product HNSW from its stored
+        vectors; no re-embedding needed.
+        """
+        print(f" Converting {type(self.index).__name__} ({self.index.ntotal} vectors) to inner-product HNSW...")
+        embeddings_array = self.index.reconstruct_n(0, self.index.ntotal)
+        faiss.normalize_L2(embeddings_array)
+        self.index = self._build_index(embeddings_array)
+        self._save_index()
+    
+    def _build_index(self, embeddings_array: np.ndarray) -> faiss.Index:
+        """
+        HNSW graph over scalar-quantized vectors (hnsw_sq_type), ranked by
+        inner product. embeddings_array must be L2-normalized.
+        """
+        index = faiss.IndexHNSWSQ(embeddings_array.shape[1], self.hnsw_sq_type,
+                                  self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.hnsw_ef_construction
+        index.hnsw.efSearch = self.hnsw_ef_search
+        # Training learns the per-dimension value range used for quantization
+        index.train(embeddings_array)
+        index.add(embeddings_array)
+        return index
+    
+    def _save_index(self):
+        """
+        Write the FAISS index atomically (temp file + rename), so other
+        processes that memory-mapped the old file never see a partial write.
+        """
+        # Per-process temp name: API workers may save at the same time
+        tmp_path = f"{self.faiss_index_path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.faiss_index_path)
+        self.index_base_ntotal = self.index.ntotal
+        
+        # Every segment is in the new file now
+        for segment_path in self.faiss_segments_dir.glob("*.npy"):
+            segment_path.unlink(missing_ok=True)
+    
+    def _save_new_vectors(self, embeddings_array: np.ndarray):
+        """
+        Persist vectors just added to self.index as a new segment file
+        (O(new), no HNSW graph serialization).
+        """
+        start_position = self.index.ntotal - len(embeddings_array)
+        self.faiss_segments_dir.mkdir(parents=True, exist_ok=True)
+        # Temp file + rename: a segment is either complete or absent
+        tmp_path = self.faiss_segments_dir / f"{start_position:012d}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(embeddings_array, dtype=np.float32))
+        os.replace(tmp_path, self.faiss_segments_dir / f"{start_position:012d}.npy")
+    
+    def _compact_segments(self):
+        """Write the full index once segments outgrow delta_compact_ratio of it."""
+        if self.index.ntotal - self.index_base_ntotal > self.delta_compact_ratio * self.index_base_ntotal:
+            print(" Compacting FAISS segments into the index file...")
+            self._save_index()
+    
+    def _read_segments(self, end_position: int) -> Iterator[np.ndarray]:
+        """
+        Segments that extend the loaded index file up to end_position, in
+        position order. Segments already folded into the index file (left
+        over from an interrupted compaction) or after a gap are skipped, and
+        ones from end_position on (never committed) are deleted.
+        """
+        if not self.faiss_segments_dir.exists():
+            return
         
-        print(f" Database updated with {len(new_transcripts)} new transcript mappings\n")
+        next_position = self.index_base_ntotal
+        for segment_path in sorted(self.faiss_segments_dir.glob("*.npy")):
+            if not segment_path.stem.isdigit():
+                continue  # temp file of an unfinished write
+            if int(segment_path.stem) >= end_position:
+                segment_path.unlink(missing_ok=True)
+                continue
+            if segment_path.stem != f"{next_position:012d}":
+                continue
+            segment = np.load(segment_path)
+            next_position += len(segment)
+            yield segment
     
     def _create_all_embeddings(self):
         """Create embeddings from scratch (first run only)."""
@@ -202,17 +519,19 @@ class CloudRAGSystem:
             print(" No transcripts in database!")
             return
         
+        transcripts_by_company = self._transcripts_by_company(companies)
+        max_transcript_id = max((t['id'] for transcripts in transcripts_by_company
+                                 for t in transcripts), default=0)
+        
         all_chunks = []
         chunk_metadata = []
         
         # Process each company
-        for company in companies:
-            transcripts = self.db.get_transcripts_by_company(company)
-            
+        for company, transcripts in zip(companies, transcripts_by_company):
             for transcript in transcripts:
                 print(f" Processing: {company} {transcript['quarter']} {transcript['fiscal_year']}")
                 
-                raw_text = transcript['raw_text']
+                raw_text = self.db.get_transcript_text(transcript['id'])
                 chunks = self._chunk_text(raw_text)
                 
                 all_chunks.extend(chunks)
@@ -230,19 +549,7 @@ class CloudRAGSystem:
         print(f"\n Total: {len(all_chunks)} chunks from {len(companies)} companies")
         
         print(f"\n Generating embeddings...")
-        embeddings = []
-        total_tokens = 0
-        
-        for i, chunk in enumerate(all_chunks):
-            response = client.embeddings.create(
-                model=self.embedding_model,
-                input=chunk
-            )
-            embeddings.append(response.data[0].embedding)
-            total_tokens += response.usage.total_tokens
-            
-            if (i + 1) % 50 == 0:
-                print(f"   Embedded {i+1}/{len(all_chunks)} chunks...")
+        embeddings_array, total_tokens = self._embed_texts(all_chunks)
         
         # Calculate cost again
         embedding_cost = total_tokens * self.embedding_cost_per_token
@@ -254,130 +561,318 @@ class CloudRAGSystem:
         self.db.set_metadata("embedding_model", self.embedding_model)
         
         # Build FAISS index
-        embeddings_array = np.array(embeddings).astype('float32')
-        dimension = embeddings_array.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings_array)
+        faiss.normalize_L2(embeddings_array)
+        self.index = self._build_index(embeddings_array)
         
         print(f" Built FAISS index: {embeddings_array.shape}")
         
-        # Save everything
-        faiss.write_index(self.index, self.faiss_index_path)
-        np.save(self.chunks_path, np.array(all_chunks, dtype=object))
-        with open(self.metadata_path, "w") as f:
-            json.dump(chunk_metadata, f)
+        # Save everything. The old metadata.npz goes first: until the new one
+        # is written, a restart finds nothing committed and rebuilds again.
+        Path(self.metadata_path).unlink(missing_ok=True)
+        self._save_index()
+        self.chunks.replace(all_chunks)
         
-        self.chunks = all_chunks
-        self.chunk_metadata = chunk_metadata
+        # Update database with chunk mappings
+        new_metadata = ChunkMetadata.from_records(chunk_metadata)
+        self._save_chunk_mappings(all_chunks, new_metadata.transcript_ids, 0)
         
-        print(f" Saved embeddings to disk")
+        self.chunk_metadata = new_metadata
+        self.chunk_metadata.save(self.metadata_path)
+        self._save_manifest(max_transcript_id)
         
-        # Update database with chunk mappings
-        faiss_position = 0
-        for transcript_id in set(meta['transcript_id'] for meta in chunk_metadata):
-            # Get chunks for this transcript
-            transcript_chunks = [chunk for chunk, meta in zip(all_chunks, chunk_metadata)
-                               if meta['transcript_id'] == transcript_id]
-            transcript_positions = list(range(faiss_position, 
-                                            faiss_position + len(transcript_chunks)))
-            
-            # Store in database
+        print(f" Saved embeddings to disk")
+        print(" Database updated with chunk mappings")
+    
+    def _read_manifest(self) -> Optional[Dict]:
+        if not Path(self.manifest_path).exists():
+            return None
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+    
+    def _save_manifest(self, max_transcript_id: int):
+        """Record what the saved index covers, so startup can skip the full scan."""
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ntotal": self.index.ntotal, "max_transcript_id": max_transcript_id}, f)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def _transcripts_by_company(self, companies: List[str]) -> List[List[Dict]]:
+        """Transcript listings for each company, queried concurrently (pooled connections)."""
+        with ThreadPoolExecutor(max_workers=self.db.pool_size) as executor:
+            return list(executor.map(self.db.get_transcripts_by_company, companies))
+    
+    def _save_chunk_mappings(self, chunks: List[str], transcript_ids: np.ndarray,
+                             start_position: int):
+        """
+        Record each chunk's FAISS position in the database, grouped by
+        transcript in one pass. chunks[i] (of transcript_ids[i]) was added
+        at start_position + i.
+        """
+        groups = defaultdict(lambda: ([], []))
+        for position, (chunk, transcript_id) in enumerate(zip(chunks, transcript_ids.tolist()),
+                                                          start=start_position):
+            transcript_chunks, transcript_positions = groups[transcript_id]
+            transcript_chunks.append(chunk)
+            transcript_positions.append(position)
+        
+        for transcript_id, (transcript_chunks, transcript_positions) in groups.items():
             self.db.insert_embedding_chunks(transcript_id, 
                                           transcript_chunks, 
                                           transcript_positions)
-            faiss_position += len(transcript_chunks)
+    
+    def _embed_texts(self, texts: List[str]) -> Tuple[np.ndarray, int]:
+        """
+        Embed texts in batches of at most embed_batch_size inputs and
+        embed_batch_max_tokens tokens, up to embed_max_concurrency requests
+        in flight.
+        Returns a float32 (len(texts), d) array (rows in input order) and
+        the tokens billed.
+        """
+        return asyncio.run(self._embed_texts_async(texts))
+    
+    def _token_batches(self, token_counts: np.ndarray) -> List[np.ndarray]:
+        """
+        Group text positions into batches of similar length, packed greedily
+        up to embed_batch_max_tokens / embed_batch_size, so requests are
+        evenly sized and none exceeds the API's per-request token cap.
+        """
+        order = np.argsort(token_counts, kind="stable")
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for end, position in enumerate(order):
+            if end > start and (end - start == self.embed_batch_size or
+                                batch_tokens + token_counts[position] > self.embed_batch_max_tokens):
+                batches.append(order[start:end])
+                start = end
+                batch_tokens = 0
+            batch_tokens += token_counts[position]
+        if start < len(order):
+            batches.append(order[start:])
+        return batches
+    
+    async def _embed_texts_async(self, texts: List[str]) -> Tuple[np.ndarray, int]:
+        encoder = _token_encoder(self.embedding_model)
+        token_counts = np.array([len(tokens) for tokens in encoder.encode_batch(texts)],
+                                dtype=np.int64)
+        batches = self._token_batches(token_counts)
+        semaphore = asyncio.Semaphore(self.embed_max_concurrency)
+        rate_limiter = _RateLimiter(self.embed_requests_per_minute, self.embed_tokens_per_minute)
+        embedded = 0
+        total_tokens = 0
+        # Allocated once the first response shows the dimension; rows are
+        # written straight from each response (no list of Python float lists)
+        embeddings = None
+        
+        async def embed_batch(positions: np.ndarray):
+            nonlocal embedded, total_tokens, embeddings
+            batch = [texts[position] for position in positions]
+            batch_tokens = int(token_counts[positions].sum())
+            async with semaphore:
+                for attempt in range(self.embed_max_retries + 1):
+                    await rate_limiter.acquire(batch_tokens)
+                    try:
+                        response = await aclient.embeddings.create(
+                            model=self.embedding_model,
+                            input=batch
+                        )
+                        break
+                    except RateLimitError:
+                        if attempt == self.embed_max_retries:
+                            raise
+                        await asyncio.sleep(2 ** attempt)
+            
+            if embeddings is None:
+                embeddings = np.empty((len(texts), len(response.data[0].embedding)), dtype=np.float32)
+            # Scatter back to input order; each item carries its position within its batch
+            for item in response.data:
+                embeddings[positions[item.index]] = item.embedding
+            total_tokens += response.usage.total_tokens
+            
+            embedded += len(batch)
+            print(f"   Embedded {embedded}/{len(texts)} chunks...")
         
-        print(" Database updated with chunk mappings")
+        # A client per run: its connections belong to this asyncio.run() loop
+        async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) as aclient:
+            await asyncio.gather(*[embed_batch(batch) for batch in batches])
+        
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        return embeddings, total_tokens
     
     def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """Chunk text with overlap."""
-        chunks = []
-        start = 0
         text_length = len(text)
         
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += (chunk_size - overlap)
+        # All chunk offsets at once instead of stepping a Python counter
+        starts = np.arange(0, text_length, chunk_size - overlap)
+        ends = np.minimum(starts + chunk_size, text_length)
         
-        return chunks
+        return [text[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
     
-    def query(self, question: str, company_filter: Optional[str] = None, 
-             top_k: int = 6) -> Dict:
-        """Query the RAG system."""
-        query_cost = 0.0
+    def embed_question(self, question: str) -> Tuple[np.ndarray, float]:
+        """
+        Embed a question for FAISS search.
+        Returns a unit-length (1, d) float32 array and the embedding cost,
+        which is also added to total_cost. Repeated questions are served from
+        the question cache at no cost.
+        """
+        key = hashlib.blake2b(f"{self.embedding_model}:{question}".encode(), digest_size=16).hexdigest()
+        q_embedding = self._cached_question_embedding(key)
+        if q_embedding is not None:
+            return q_embedding, 0.0
         
-        # Get question embedding
         q_response = client.embeddings.create(
             model=self.embedding_model,
             input=question
         )
-        q_embedding = np.array([q_response.data[0].embedding]).astype('float32')
-        query_cost += q_response.usage.total_tokens * self.embedding_cost_per_token
-        
-        # Search FAISS
-        search_k = top_k * 10 if company_filter else top_k
-        distances, indices = self.index.search(q_embedding, search_k)
-        
-        # Get chunks and filter
-        context_chunks = []
-        sources = []
-        
-        for idx in indices[0]:
-            # Get chunk and metadata
-            chunk_text = self.chunks[idx]
-            meta = self.chunk_metadata[idx]
-            
-            # Filter by company if specified
-            if company_filter and meta['company'].lower() != company_filter.lower():
-                continue
-            
-            context_chunks.append(chunk_text)
-            sources.append({
-                "company": meta['company'],
-                "quarter": meta['quarter'],
-                "fiscal_year": meta['fiscal_year']
-            })
-            
-            if len(context_chunks) >= top_k:
-                break
+        # Straight to a (1, d) float32 array (no float64 intermediate)
+        q_embedding = np.asarray(q_response.data[0].embedding, dtype=np.float32)[None, :]
+        faiss.normalize_L2(q_embedding)  # the index ranks by inner product
+        embedding_cost = q_response.usage.total_tokens * self.embedding_cost_per_token
+        
+        self._cache_question_embedding(key, q_embedding)
+        self.total_cost += embedding_cost
+        return q_embedding, embedding_cost
+    
+    def _cached_question_embedding(self, key: str) -> Optional[np.ndarray]:
+        """Look a question up in memory, then on disk."""
+        with self._question_cache_lock:
+            q_embedding = self._question_cache.get(key)
+            if q_embedding is not None:
+                self._question_cache.move_to_end(key)
+                return q_embedding
+        
+        path = self.question_cache_dir / f"{key}.npy"
+        if not path.exists():
+            return None
+        q_embedding = np.load(path)
+        self._remember_question_embedding(key, q_embedding)
+        return q_embedding
+    
+    def _cache_question_embedding(self, key: str, q_embedding: np.ndarray):
+        self._remember_question_embedding(key, q_embedding)
+        
+        # Temp file + rename, so other processes never load a partial file
+        self.question_cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.question_cache_dir / f"{key}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, q_embedding)
+        os.replace(tmp_path, self.question_cache_dir / f"{key}.npy")
+    
+    def _remember_question_embedding(self, key: str, q_embedding: np.ndarray):
+        q_embedding.setflags(write=False)  # shared by every cache hit
+        with self._question_cache_lock:
+            self._question_cache[key] = q_embedding
+            self._question_cache.move_to_end(key)
+            while len(self._question_cache) > self.question_cache_size:
+                self._question_cache.popitem(last=False)
+    
+    def _retrieve(self, question: str, company_filter: Optional[str], top_k: int,
+                  q_embedding: Optional[np.ndarray],
+                  ef_search: Optional[int]) -> Tuple[List[str], List[Dict], float]:
+        """
+        Find the context chunks for a question.
+        Returns (chunks, per-chunk sources, embedding cost paid here).
+        """
+        embedding_cost = 0.0
         
-        # Build context
-        context = "\n\n".join(context_chunks)
+        # Get question embedding
+        if q_embedding is None:
+            q_embedding, embedding_cost = self.embed_question(question)
+        
+        # Search FAISS (over-fetch so keyword matches can be ranked in).
+        # A company filter is applied inside the search, so every hit matches it.
+        search_k = top_k * 4
+        params = None
+        if company_filter:
+            selector = self.company_selectors.get(company_filter.lower(), self.no_match_selector)
+            params = faiss.SearchParametersHNSW(
+                sel=selector, efSearch=ef_search or self.hnsw_filtered_ef_search
+            )
+        elif ef_search:
+            params = faiss.SearchParametersHNSW(efSearch=ef_search)
+        distances, indices = self.index.search(q_embedding, search_k, params=params)
         
-        # Generate answer with GPT
-        response = client.chat.completions.create(
-            model=self.generation_model,
-            messages=[
-                {"role": "system", "content": "You are analyzing earnings call transcripts from major cloud/SaaS companies. Answer based only on the provided context. When relevant, mention which company you're referring to. Be specific with numbers, quotes, and strategic insights."},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
-            ],
-            temperature=0
+        # Keyword (BM25) ranking of whole transcripts, best first
+        keyword_ids = np.asarray(
+            self.db.keyword_search(question, limit=self.keyword_search_limit), dtype=np.int64
         )
         
-        answer = response.choices[0].message.content
-        
-        # Calculate generation cost
-        input_tokens = response.usage.prompt_tokens
-        output_tokens = response.usage.completion_tokens
-        query_cost += (input_tokens * self.generation_cost_input + 
-                       output_tokens * self.generation_cost_output)
+        # Fuse vector rank and keyword rank (reciprocal rank fusion), as array
+        # ops over all candidates at once instead of a Python loop per hit
+        result_indices = indices[0][indices[0] >= 0]  # FAISS pads with -1
+        result_transcript_ids = self.chunk_metadata.transcript_ids[result_indices]
+        scores = 1.0 / (self.rrf_k + np.arange(len(result_indices)))
+        
+        if len(keyword_ids):
+            # (candidates x keyword hits) match matrix: both sides are a few dozen at most
+            matches = result_transcript_ids[:, None] == keyword_ids[None, :]
+            has_keyword_rank = matches.any(axis=1)
+            keyword_ranks = matches.argmax(axis=1)
+            scores[has_keyword_rank] += 1.0 / (self.rrf_k + keyword_ranks[has_keyword_rank])
+        
+        # Stable sort: ties keep their vector-search order
+        top_indices = result_indices[np.argsort(-scores, kind='stable')[:top_k]].tolist()
+        
+        # Sources stay in relevance order
+        meta = self.chunk_metadata
+        sources = [
+            {
+                "company": meta.companies[idx],
+                "quarter": meta.quarters[idx],
+                "fiscal_year": meta.fiscal_years[idx]
+            }
+            for idx in top_indices
+        ]
         
-        self.total_cost += query_cost
+        # Context goes into the prompt in index order, so the same set of chunks
+        # always produces the same prompt prefix and OpenAI's prompt cache
+        # (provider-side KV cache) can skip re-processing it
+        context_chunks = [self.chunks[idx] for idx in sorted(top_indices)]
         
-        # Unique sources
+        return context_chunks, sources, embedding_cost
+    
+    def _build_messages(self, context: str, question: str) -> List[Dict]:
+        """Chat messages for answer generation."""
+        return [
+            {"role": "system", "content": "You are analyzing earnings call transcripts from major cloud/SaaS companies. Answer based only on the provided context. When relevant, mention which company you're referring to. Be specific with numbers, quotes, and strategic insights."},
+            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
+        ]
+    
+    def _record_generation_cost(self, usage) -> float:
+        """Cost of one chat completion; also added to total_cost."""
+        input_tokens = usage.prompt_tokens
+        output_tokens = usage.completion_tokens
+        
+        # Prompt tokens served from OpenAI's prompt cache are billed at a discount
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        
+        generation_cost = ((input_tokens - cached_tokens) * self.generation_cost_input + 
+                           cached_tokens * self.generation_cost_cached_input + 
+                           output_tokens * self.generation_cost_output)
+        
+        # Embedding cost was already tallied by embed_question
+        self.total_cost += generation_cost
+        return generation_cost
+    
+    def _build_result(self, answer: str, sources: List[Dict], context_chunks: List[str],
+                      context: str, query_cost: float) -> Dict:
+        """Assemble the response returned by query() / query_stream()."""
+        # Unique sources (only the first 3 are returned)
         unique_sources = []
         seen = set()
         for source in sources:
-            key = f"{source['company']}_{source['quarter']}_{source['fiscal_year']}"
+            key = (source['company'], source['quarter'], source['fiscal_year'])
             if key not in seen:
                 unique_sources.append(source)
                 seen.add(key)
+                if len(unique_sources) == 3:
+                    break
         
         return {
             "answer": answer,
-            "sources": unique_sources[:3],
+            "sources": unique_sources,
             "cost": query_cost,
             "metadata": {
                 "chunks_used": len(context_chunks),
@@ -386,6 +881,77 @@ class CloudRAGSystem:
             }
         }
     
+    def query(self, question: str, company_filter: Optional[str] = None, 
+             top_k: int = 6, q_embedding: Optional[np.ndarray] = None,
+             ef_search: Optional[int] = None) -> Dict:
+        """
+        Query the RAG system.
+        Pass q_embedding (from embed_question) to reuse an embedding the caller
+        already paid for; its cost is then not included in the returned cost.
+        ef_search overrides the HNSW search beam for this query (higher = better
+        recall, slower).
+        """
+        context_chunks, sources, query_cost = self._retrieve(
+            question, company_filter, top_k, q_embedding, ef_search
+        )
+        
+        # Build context
+        context = "\n\n".join(context_chunks)
+        
+        # Generate answer with GPT
+        response = client.chat.completions.create(
+            model=self.generation_model,
+            messages=self._build_messages(context, question),
+            temperature=0
+        )
+        
+        answer = response.choices[0].message.content
+        query_cost += self._record_generation_cost(response.usage)
+        
+        return self._build_result(answer, sources, context_chunks, context, query_cost)
+    
+    def query_stream(self, question: str, company_filter: Optional[str] = None,
+                     top_k: int = 6, q_embedding: Optional[np.ndarray] = None,
+                     ef_search: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Streaming version of query().
+        Yields {"type": "token", "content": ...} events as the answer is
+        generated, then one {"type": "done", ...} event with the same fields
+        query() returns.
+        """
+        context_chunks, sources, query_cost = self._retrieve(
+            question, company_filter, top_k, q_embedding, ef_search
+        )
+        context = "\n\n".join(context_chunks)
+        
+        stream = client.chat.completions.create(
+            model=self.generation_model,
+            messages=self._build_messages(context, question),
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        answer_parts = []
+        usage = None
+        for chunk in stream:
+            # Usage arrives on a final chunk with no choices
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                token = chunk.choices[0].delta.content
+                answer_parts.append(token)
+                yield {"type": "token", "content": token}
+        
+        if usage is not None:
+            query_cost += self._record_generation_cost(usage)
+        
+        yield {
+            "type": "done",
+            **self._build_result("".join(answer_parts), sources, context_chunks,
+                                 context, query_cost)
+        }
+    
     def get_cost_summary(self) -> Dict:
         """Get cost tracking summary."""
         embedding_cost = self.db.get_metadata("last_embedding_cost") or 0.0
@@ -0,0 +1,163 @@
+"""
+semantic_cache.py
+-----------------
+Two-tier response cache for RAG queries.
+Exact layer: normalized question hash. Semantic layer: random-projection LSH
+over question embeddings, so rephrased questions reuse a cached answer.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+class SemanticCache:
+    """Caches query responses by exact question and by embedding similarity."""
+    
+    def __init__(self, similarity_threshold: float = 0.97, ttl_seconds: float = 3600,
+                 max_entries: int = 1024, n_tables: int = 8, n_bits: int = 12,
+                 seed: int = 42):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+        
+        # Random projections, created once the embedding dimension is known
+        self._projections = None
+        self._bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+        
+        # exact key -> entry, oldest first (for eviction)
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        # (table, scope, hash) -> exact keys in that bucket
+        self._buckets: Dict[Tuple, set] = {}
+        self._lock = threading.Lock()
+        
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+    
+    @staticmethod
+    def _scope(company_filter: Optional[str], top_k: int, ef_search: Optional[int]) -> Tuple:
+        """Answers are only reusable for the same filter, top_k and search recall setting."""
+        return (company_filter.lower() if company_filter else None, top_k, ef_search)
+    
+    def _exact_key(self, question: str, company_filter: Optional[str], top_k: int,
+                   ef_search: Optional[int]) -> Tuple:
+        digest = hashlib.blake2b(question.lower().strip().encode()).digest()
+        return (digest, self._scope(company_filter, top_k, ef_search))
+    
+    def _normalize(self, embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def _lsh_hashes(self, vector: np.ndarray) -> List[int]:
+        """One integer hash per table from the signs of the projections."""
+        if self._projections is None:
+            rng = np.random.default_rng(self.seed)
+            self._projections = rng.standard_normal(
+                (self.n_tables, self.n_bits, vector.shape[0])
+            ).astype('float32')
+        
+        signs = (self._projections @ vector) > 0  # (n_tables, n_bits)
+        return (signs.astype(np.int64) @ self._bit_weights).tolist()
+    
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for bucket_key in entry['buckets']:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[bucket_key]
+    
+    def _live_entry(self, key: Tuple) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires_at'] < time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+    
+    def get(self, question: str, company_filter: Optional[str] = None,
+            top_k: int = 6, ef_search: Optional[int] = None) -> Optional[Dict]:
+        """Exact lookup on the normalized question."""
+        key = self._exact_key(question, company_filter, top_k, ef_search)
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return None
+            self.hits["exact"] += 1
+            return entry['response']
+    
+    def get_similar(self, embedding: np.ndarray, company_filter: Optional[str] = None,
+                    top_k: int = 6, ef_search: Optional[int] = None) -> Optional[Dict]:
+        """Near-duplicate lookup: best cosine match among LSH bucket candidates."""
+        vector = self._normalize(embedding)
+        scope = self._scope(company_filter, top_k, ef_search)
+        
+        with self._lock:
+            candidates = set()
+            for table, code in enumerate(self._lsh_hashes(vector)):
+                candidates |= self._buckets.get((table, scope, code), set())
+            
+            best_entry, best_score = None, self.similarity_threshold
+            for key in candidates:
+                entry = self._live_entry(key)
+                if entry is None:
+                    continue
+                score = float(entry['embedding'] @ vector)
+                if score >= best_score:
+                    best_entry, best_score = entry, score
+            
+            if best_entry is None:
+                self.misses += 1
+                return None
+            self.hits["semantic"] += 1
+            return best_entry['response']
+    
+    def put(self, question: str, company_filter: Optional[str], top_k: int,
+            embedding: np.ndarray, response: Dict, ef_search: Optional[int] = None):
+        """Store a response under both the exact key and its LSH buckets."""
+        key = self._exact_key(question, company_filter, top_k, ef_search)
+        scope = key[1]
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            self._remove(key)
+            bucket_keys = [(table, scope, code)
+                           for table, code in enumerate(self._lsh_hashes(vector))]
+            self._entries[key] = {
+                'embedding': vector,
+                'response': response,
+                'buckets': bucket_keys,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            for bucket_key in bucket_keys:
+                self._buckets.setdefault(bucket_key, set()).add(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+    
+    def clear(self):
+        """Drop all cached responses (e.g. after new transcripts are embedded)."""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def get_stats(self) -> Dict:
+        """Get cache hit/miss counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.hits["exact"],
+                "semantic_hits": self.hits["semantic"],
+                "misses": self.misses
+            }